@@ -1,31 +1,63 @@
 import numpy as np
 import os
 
+from Skeleton import Skeleton
+from scoring import masked_rmse, score_sums
+
 
 class OptimalParams(object):
     """
-    This class purpose is to gather all the info relevant to skeletons pair
+    This class purpose is to gather all the info relevant to skeletons pair.
+    No image is kept, the skeleton image of a record can be regenerated from its images paths and params.
     """
-    h = None
-    w = None
+    __slots__ = ('h', 'w', '_has_skeleton', '_rmse', '_first_skeleton', '_second_skeleton', '_score', '_translate',
+                 '_scale', '_upper_path', '_upper_name', '_bottom_path', '_bottom_name')
 
     def __init__(self, first_image_parts, second_image_parts, translate, scale):
         """
         Constructor
         """
-        self._skeleton_image = None
+        self.h = None
+        self.w = None
         self._has_skeleton = False
         self._rmse = None
-        self._first_image_parts = first_image_parts
-        self._second_image_parts = second_image_parts
+        self._first_skeleton = Skeleton.single(first_image_parts)
+        self._second_skeleton = Skeleton.single(second_image_parts)
         self._score = 0
         self._translate = translate
         self._scale = scale
-        self._upper = None
+        self._upper_path = None
         self._upper_name = None
-        self._bottom = None
+        self._bottom_path = None
         self._bottom_name = None
 
+    @classmethod
+    def restore(cls, first_skeleton, second_skeleton, translate, scale, upper, bottom, h, w, rmse, score,
+                has_skeleton=True):
+        """
+        Rebuild a record from stored values, without calculating anything
+        :param first_skeleton: merged image Skeleton
+        :param second_skeleton: original image Skeleton
+        :param translate:
+        :param scale:
+        :param upper: upper image path
+        :param bottom: bottom image path
+        :param h:
+        :param w:
+        :param rmse:
+        :param score:
+        :param has_skeleton:
+        :return: OptimalParams
+        """
+        params = cls([first_skeleton], [second_skeleton], translate, scale)
+        params.upper = upper
+        params.bottom = bottom
+        params.set_image_size(h, w)
+        params._rmse = rmse
+        params._score = score
+        params._has_skeleton = has_skeleton
+        return params
+
     @property
     def scale(self):
         return self._scale
@@ -36,34 +68,41 @@ class OptimalParams(object):
 
     @property
     def upper(self):
-        return [self._upper_name,self._upper]
+        return [self._upper_name, self._upper_path]
 
     @upper.setter
     def upper(self, value):
-        self._upper_name = os.path.basename(value[0])
-        self._upper = value[1]
+        """
+        :param value: upper image path
+        """
+        self._upper_name = os.path.basename(value)
+        self._upper_path = value
 
     @property
     def bottom(self):
-        return [self._bottom_name,self._bottom]
+        return [self._bottom_name, self._bottom_path]
 
     @bottom.setter
     def bottom(self, value):
-        self._bottom_name = os.path.basename(value[0])
-        self._bottom = value[1]
+        """
+        :param value: bottom image path
+        """
+        self._bottom_name = os.path.basename(value)
+        self._bottom_path = value
 
     @property
     def score(self):
         return self._score
 
-    @property
-    def skeleton_image(self):
-        return self._skeleton_image
-
-    @skeleton_image.setter
-    def skeleton_image(self, value):
-        self.h, self.w, _ = value.shape
-        self._skeleton_image = value
+    def set_image_size(self, h, w):
+        """
+        Set the size of the merged image the skeletons were found on
+        :param h:
+        :param w:
+        :return:
+        """
+        self.h = h
+        self.w = w
 
     @property
     def has_skeleton(self):
@@ -77,44 +116,39 @@ class OptimalParams(object):
     def rmse(self):
         return self._rmse
 
+    @property
+    def first_skeleton(self):
+        return self._first_skeleton
+
+    @property
+    def second_skeleton(self):
+        return self._second_skeleton
+
     def calculate_rmse(self):
         """
         Calculate Root Mean Square Error between skeletong upper points
         :return:
         """
-        distances = []
-        # top parts only (upper)
-        for i in [0, 1, 2, 3, 4, 5, 6, 7, 14, 15, 16, 17]:
-            x1 = None
-            y1 = None
-            x2 = None
-            y2 = None
-            if len(self._first_image_parts) == 1 and self._first_image_parts[0].body_parts.__contains__(i):
-                x1 = self._first_image_parts[0].body_parts[i].x * self.h
-                y1 = self._first_image_parts[0].body_parts[i].y * self.w
-            if len(self._second_image_parts) == 1 and self._second_image_parts[0].body_parts.__contains__(i):
-                x2 = self._second_image_parts[0].body_parts[i].x * self.h
-                y2 = self._second_image_parts[0].body_parts[i].y * self.w
-            if x1 is not None and x2 is not None and y1 is not None and y2 is not None:
-                distances.append(self.calculateDistance([x1, y1], [x2, y2]))
-        self._rmse = np.sqrt(np.array(distances).mean())
+        self._rmse = masked_rmse(self._first_skeleton.points[None], self._second_skeleton.points[None],
+                                 self._first_skeleton.mask[None], self._second_skeleton.mask[None],
+                                 (self.h, self.w))[0]
 
     def calculateDistance(self, point1, point2):
         """
         Calculate Euclidean Distance
-        :param point1:
-        :param point2:
+        :param point1: point or (n, 2) array of points
+        :param point2: point or (n, 2) array of points
         :return:
         """
-        return np.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
+        point1 = np.asarray(point1, np.float64)
+        point2 = np.asarray(point2, np.float64)
+        return np.sqrt(((point1 - point2) ** 2).sum(axis=-1))
 
-    def calculate_skeleton_score(self, body_parts):
+    def calculate_skeleton_score(self, body_parts=None):
         """
         Sum each point's score
-        :param body_parts:
+        :param body_parts: humans to take the scores from, defaults to the first skeleton
         :return:
         """
-        for i in range(0, 17):
-            if len(self._first_image_parts) == 1 and self._first_image_parts[0].body_parts.__contains__(i):
-                self._score += body_parts[0].body_parts[i].score
-
+        skeleton = self._first_skeleton if body_parts is None else Skeleton.single(body_parts)
+        self._score += score_sums(skeleton.score[None], self._first_skeleton.mask[None])[0]
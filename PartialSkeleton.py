@@ -1,6 +1,8 @@
-import gc
+import argparse
+import multiprocessing
 import operator
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import cv2
 import matplotlib.pyplot as plt
@@ -9,11 +11,19 @@ import numpy as np
 import common
 import video_utils
 from OptimalParams import OptimalParams
+from Skeleton import Skeleton, draw_skeleton
+from results_store import ResultStore, export_excel, params_columns, score_columns
+from scoring import confidence
+from batch_inference import inference_batch
+from composition import IDENTITY, CanvasPool, classify_affine, stack_images, translated_stack
+from donor_index import DonorIndex
+from inference_cache import CachedEstimator, LRUCache, cached_estimator, image_key
+from job_manifest import JobManifest
+import model_registry
+from model_registry import get_pose_estimator
+from upper_library import UpperLibrary, fit_upper
 from estimator import TfPoseEstimator
-from networks import get_graph_path
 import pickle
-import pandas as pd
-from pandas import DataFrame, Series
 
 
 def create_affined_image(image, pts_src, pts_dst):
@@ -26,6 +36,8 @@ def create_affined_image(image, pts_src, pts_dst):
     """
     rows, cols, ch = image.shape
     M = cv2.getAffineTransform(pts_src, pts_dst)
+    if classify_affine(M) == IDENTITY:
+        return image.copy()
     return cv2.warpAffine(image, M, (cols, rows))
 
 
@@ -64,47 +76,195 @@ def draw_human(npimg, humans, imgcopy=False):
     """
     Draw skeleton on image
     :param npimg:
-    :param humans:
+    :param humans: list of Human or Skeleton, the one with the highest score is drawn
     :param imgcopy:
     :return:
     """
-    if imgcopy:
-        npimg = np.copy(npimg)
-    image_h, image_w = npimg.shape[:2]
-    centers = {}
+    return draw_skeleton(npimg, Skeleton.best(humans), imgcopy)
 
-    pair = (0, None)
 
-    for h in humans:
-        temp = 0
-        for part in h.body_parts:
-            temp += h.body_parts[part].score
-
-        if temp > pair[0]:
-            lst = list(pair)
-            lst[1] = h
-            lst[0] = temp
-            pair = tuple(lst)
-
-    human = pair[1]
-    # draw point
-    for i in range(common.CocoPart.Background.value):
-        if i not in human.body_parts.keys():
-            continue
-
-        body_part = human.body_parts[i]
-        center = (int(body_part.x * image_w + 0.5), int(body_part.y * image_h + 0.5))
-        centers[i] = center
-        cv2.circle(npimg, center, 3, common.CocoColors[i], thickness=3, lineType=8, shift=0)
-
-    # draw line
-    for pair_order, pair in enumerate(common.CocoPairsRender):
-        if pair[0] not in human.body_parts.keys() or pair[1] not in human.body_parts.keys():
-            continue
-
-        npimg = cv2.line(npimg, centers[pair[0]], centers[pair[1]], common.CocoColors[pair_order], 3)
+class Skeletonizer(object):
+    """
+    This class purpose is to hold everything in the partial skeleton flow that does not depend on the frame:
+    the reference body skeleton, the affine template built from the hip points, the warped upper half and hipX.
+    Once built, each frame costs a single inference on the merged image.
+    """
 
-    return npimg
+    def __init__(self, estimator, hip, reference_image_path='./images/full_body1.png', w=432, h=368,
+                 roi_cropper=None):
+        """
+        Constructor
+        :param estimator: TfPoseEstimator
+        :param hip: 3 points selected on the first frame
+        :param reference_image_path: full body image used to complete the missing upper part
+        :param w: network width
+        :param h: network height
+        :param roi_cropper: optional RoiCropper, the frame is then cropped to the detected person and scaled to the
+                            bottom slot before it is merged with the upper half
+        """
+        self.estimator = estimator
+        self.roi_cropper = roi_cropper
+        self.w = w
+        self.h = h
+        self.scales = None
+
+        # Load dummy image
+        dummy_image = common.read_imgfile(reference_image_path, None, None)
+
+        # Get dummy image skeleton
+        dummy_image_parts = estimator.inference(dummy_image, scales=self.scales)
+
+        # Collect 2 points for affine transformation
+        pts1 = np.float32(
+            [[int(dummy_image_parts[0].body_parts[8].x * h), int(dummy_image_parts[0].body_parts[8].y * w)],
+             [int(dummy_image_parts[0].body_parts[11].x * h), int(dummy_image_parts[0].body_parts[11].y * w)],
+             [int(dummy_image_parts[0].body_parts[17].x * h), int(dummy_image_parts[0].body_parts[17].y * w)]])
+        pts2 = np.float32([hip[0],
+                           hip[1],
+                           hip[2]])
+
+        # Create affine transformed of the dummy image
+        affined_dummy_image = create_affined_image(dummy_image, pts1, pts2)
+        affined_dummy_image = cv2.flip(affined_dummy_image, 0)
+
+        # Get dummy image skeleton
+        dummy_image_parts = estimator.inference(affined_dummy_image, scales=self.scales)
+
+        # Hip coordinates
+        self.hipX = int(dummy_image_parts[0].body_parts[11].x * h)
+        self.affine_matrix = cv2.getAffineTransform(pts1, pts2)
+        self.upper_part = affined_dummy_image[0:self.hipX, :].copy()
+        # merged person crops of the last inferred batch
+        self._roi_canvases = CanvasPool()
+
+    def merge(self, given_image, out=None):
+        """
+        Merge the cached upper half with the given frame
+        :param given_image:
+        :param out: (h * 2, w, 3) canvas to write to, None allocates one
+        :return: merged image
+        """
+        h = self.h
+        hipX = self.hipX
+        if out is None:
+            merged_image = np.zeros((h * 2, self.w, 3), np.uint8)
+        else:
+            merged_image = out
+            merged_image[hipX + h:] = 0
+        merged_image[0:hipX, :] = self.upper_part
+        merged_image[hipX:hipX + h, :] = given_image[:, :]
+        return merged_image
+
+    def infer(self, merged_image):
+        """
+        Find the merged image's skeleton
+        :param merged_image:
+        :return: merged image and its body parts
+        """
+        if self.roi_cropper is not None:
+            return self.infer_batch([merged_image])[0]
+        return merged_image, self.estimator.inference(merged_image, scales=self.scales)
+
+    def infer_batch(self, merged_images):
+        """
+        Find the skeletons of several merged images with a single network run
+        :param merged_images:
+        :return: list of merged image and its body parts
+        """
+        if self.roi_cropper is None:
+            return list(zip(merged_images, inference_batch(self.estimator, merged_images, scales=self.scales)))
+
+        # the frame is cropped to the person and scaled back to the bottom slot, the upper half stays as it is
+        inputs = self._roi_canvases.get((len(merged_images), self.h * 2, self.w, 3))
+        mappings = []
+        for merged_image, merged_input in zip(merged_images, inputs):
+            crop, mapping = self.roi_cropper.prepare(merged_image[self.hipX:self.hipX + self.h])
+            if crop is None:
+                merged_input[:] = merged_image
+            else:
+                self.merge(cv2.resize(crop, (self.w, self.h), interpolation=cv2.INTER_LINEAR), merged_input)
+            mappings.append(mapping)
+        results = []
+        for merged_image, mapping, parts in zip(merged_images, mappings,
+                                                inference_batch(self.estimator, list(inputs), scales=self.scales)):
+            if mapping is not None:
+                parts = self._crop_to_frame(parts, mapping, merged_image.shape)
+            results.append((merged_image, parts))
+        return results
+
+    def _crop_to_frame(self, humans, mapping, merged_shape):
+        """
+        Map the keypoints found on the bottom slot of a merged crop back to the frame, through the crop and its scale
+        :param humans: humans found on the merged crop
+        :param mapping: (offset, crop shape) of the crop in the frame
+        :param merged_shape:
+        :return: list of Human on the merged image
+        """
+        merged_h = float(merged_shape[0])
+        offset, crop_shape = mapping
+        frame_shape = (self.h, self.w)
+        mapped = []
+        for human in humans:
+            skeleton = Skeleton.from_human(human)
+            rows = skeleton.y * merged_h
+            # keypoints above the hip are on the upper half, which is not cropped
+            bottom = skeleton.mask & (rows >= self.hipX)
+            slot_points = np.stack([skeleton.x[bottom], (rows[bottom] - self.hipX) / self.h], axis=1)
+            frame_points = self.roi_cropper.to_image_points(slot_points, offset, crop_shape, frame_shape)
+            skeleton.points[bottom, 0] = frame_points[:, 0]
+            skeleton.points[bottom, 1] = (self.hipX + frame_points[:, 1] * self.h) / merged_h
+            mapped.append(skeleton.to_human())
+        return mapped
+
+    def infer_tracked(self, merged_images, tracker):
+        """
+        Find the skeletons of consecutive merged images, running the network only on the frames the tracker asks for
+        :param merged_images: consecutive video frames merged with the upper half
+        :param tracker: KeypointTracker, the keypoints are moved with optical flow on the other frames
+        :return: list of merged image and its body parts
+        """
+        return [(merged_image, tracker.process(merged_image, lambda image: self.infer(image)[1]))
+                for merged_image in merged_images]
+
+    def draw_legs(self, merged, copy=True):
+        """
+        Draw the skeleton on the merged image and take only the legs
+        :param merged: merged image and its body parts
+        :param copy: False returns a view of the merged image, valid as long as the merged image is
+        :return: legs image
+        """
+        merged_image, merged_image_parts = merged
+        merged_image_skeleton = draw_human(merged_image, merged_image_parts, imgcopy=False)
+        legs_image = merged_image_skeleton[self.hipX: self.hipX + self.h, :]
+        return legs_image.copy() if copy else legs_image
+
+    def skeletonize(self, given_image):
+        """
+        Create the legs skeleton image of a single frame
+        :param given_image:
+        :return: legs image
+        """
+        return self.draw_legs(self.infer(self.merge(given_image)))
+
+
+_skeletonizers = {}
+
+
+def get_skeletonizer(estimator, hip, reference_image_path='./images/full_body1.png', w=432, h=368, roi_cropper=None):
+    """
+    Return the cached skeletonizer of the given reference image, hip points and network size (create it if needed)
+    :param estimator:
+    :param hip:
+    :param reference_image_path:
+    :param w:
+    :param h:
+    :param roi_cropper: optional RoiCropper
+    :return: Skeletonizer
+    """
+    key = (id(estimator), reference_image_path, tuple(tuple(point) for point in hip), (w, h), id(roi_cropper))
+    if key not in _skeletonizers:
+        _skeletonizers[key] = Skeletonizer(estimator, hip, reference_image_path, w, h, roi_cropper)
+    return _skeletonizers[key]
 
 
 def skeletonize(estimator, given_image, hip, image_name):
@@ -121,288 +281,636 @@ def skeletonize(estimator, given_image, hip, image_name):
     if not os.path.exists(".\\images\\results"):
         os.makedirs(".\\images\\results")
 
-    # Initialize TF Pose Estimator
-    w = 432
-    h = 368
-    scales = None
-
-    # Load dummy image
-    dummy_image = common.read_imgfile('./images/full_body1.png', None, None)
-
-    # Get dummy image skeleton
-    dummy_image_parts = estimator.inference(dummy_image, scales=scales)
-
-    # Display the dummy image's skeleton
-    # image = TfPoseEstimator.draw_humans(dummy_image, dummy_image_parts, imgcopy=True)
-    # cv2.imshow('dummy image result', image)
-    # cv2.waitKey()
-
-    # Collect 2 points for affine transformation
-    pts1 = np.float32(
-        [[int(dummy_image_parts[0].body_parts[8].x * h), int(dummy_image_parts[0].body_parts[8].y * w)],
-         [int(dummy_image_parts[0].body_parts[11].x * h), int(dummy_image_parts[0].body_parts[11].y * w)],
-         [int(dummy_image_parts[0].body_parts[17].x * h), int(dummy_image_parts[0].body_parts[17].y * w)]])
-    pts2 = np.float32([hip[0],
-                       hip[1],
-                       hip[2]])
-
-    # Create affine transformed of the dummy image
-    affined_dummy_image = create_affined_image(dummy_image, pts1, pts2)
-    affined_dummy_image = cv2.flip(affined_dummy_image, 0)
-    # cv2.imshow("affined", affined_dummy_image)
-    # cv2.waitKey()
-
-    # Get dummy image skeleton
-    dummy_image_parts = estimator.inference(affined_dummy_image, scales=scales)
-    # image = TfPoseEstimator.draw_humans(affined_dummy_image, dummy_image_parts, imgcopy=True)
-    # cv2.imshow('dummy person result', image)
-    # cv2.waitKey()
-
-    # Hip coordinates
-    firstPersonHipX = dummy_image_parts[0].body_parts[11].x
-
-    # Combine the two images
-    hipX = int(firstPersonHipX * h)
-    # Create merged image
-    merged_image = np.zeros((h * 2, w, 3), np.uint8)
-    merged_image[0:hipX, :] = affined_dummy_image[0:hipX, :]
-    merged_image[hipX:hipX + h, :] = given_image[:, :]
-    # cv2.imshow('Merged Image', merged_image)
-    # cv2.waitKey()
-
-    # Find the merge image's skeleton
-    merged_image_parts = estimator.inference(merged_image, scales=scales)
-    merged_image_skeleton = draw_human(merged_image, merged_image_parts, imgcopy=False)
-    # cv2.imshow('merged person result', merged_image_skeleton)
-    # cv2.waitKey()
-
-    # Take only legs and show them
-    legs_image = np.zeros((h, w, 3), np.uint8)
-    legs_image[:] = 255
-    legs_image[:, :] = merged_image_skeleton[hipX: hipX + h, :]
-    # cv2.imshow('Legs', legs_image)
-    # cv2.waitKey()
+    # The reference body is computed once per hip points, only the merged image is inferred per frame
+    skeletonizer = get_skeletonizer(estimator, hip)
+    legs_image = skeletonizer.skeletonize(given_image)
     cv2.destroyAllWindows()
     # Write image to results folder
     cv2.imwrite(".\\images\\results\\{}.png".format(image_name), legs_image)
     print("Wrote image #{} to results folder".format(image_name))
 
-    del legs_image, merged_image, merged_image_parts, firstPersonHipX, affined_dummy_image, dummy_image_parts, dummy_image
-    gc.collect()
 
+# grid search space
+SCALE_FACTORS = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+TRANSLATE_FACTORS = [0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50]
+
+# skeletons of the unmodified upper + bottom images, shared by all translations and grid runs
+original_skeletons = LRUCache(max_size=1024)
+
+
+def original_skeleton(estimator, orig_image):
+    """
+    Get the skeleton of an unmodified upper + bottom image, inferred only once per image content
+    :param estimator:
+    :param orig_image:
+    :return: humans
+    """
+    key = (id(estimator), image_key(orig_image))
+    orig_image_parts = original_skeletons.get(key)
+    if orig_image_parts is None:
+        orig_image_parts = estimator.inference(orig_image, scales=None)
+        original_skeletons.put(key, orig_image_parts)
+    return orig_image_parts
+
+
+def merge_translated(upper, bottom, translate_factor):
+    """
+    Fit the upper image to the bottom's size, translate it and put it on top of the bottom image
+    :param upper:
+    :param bottom:
+    :param translate_factor: translation in pixels
+    :return: merged image
+    """
+    return translated_stack(upper, bottom, [translate_factor])[0]
+
+
+def prepare_pair(upper_image, bottom_image, factor, upper_library=None, upper_path=None):
+    """
+    Scale down the bottom image and fit the upper image to its size
+    :param upper_image:
+    :param bottom_image:
+    :param factor: bottom scale factor
+    :param upper_library: UpperLibrary the fitted upper is taken from, None fits it here
+    :param upper_path: upper image file (needed with an upper library)
+    :return: cropped upper affined image, scaled bottom image
+    """
+    height_b, width_b, channels = bottom_image.shape
+    # Scale down and pad
+    scaled_bottom = cv2.resize(bottom_image, (int(width_b * factor), int(height_b * factor)), fx=factor,
+                               fy=factor, interpolation=cv2.INTER_AREA)
+    if upper_library is not None:
+        return upper_library.get(upper_image, upper_path, scaled_bottom.shape[:2]).image, scaled_bottom
+    return fit_upper(upper_image, *scaled_bottom.shape[:2]), scaled_bottom
+
+
+def render_candidate(estimator, params):
+    """
+    Regenerate the skeleton image of a search result from its images and params
+    :param estimator:
+    :param params: OptimalParams
+    :return: merged image with the skeleton drawn on it
+    """
+    upper_affined_image, scaled_bottom = prepare_pair(cv2.imread(params.upper[1]), cv2.imread(params.bottom[1]),
+                                                      params.scale)
+    merged_image = merge_translated(upper_affined_image, scaled_bottom, params.translate)
+    merged_image_parts = estimator.inference(merged_image, scales=None)
+    return TfPoseEstimator.draw_humans(merged_image, merged_image_parts, imgcopy=True)
+
+
+def local_confidence(params_list, lam):
+    """
+    Confidence of each params normalized over the given list only
+    :param params_list:
+    :param lam:
+    :return: numpy array of confidences
+    """
+    if len(params_list) < 2:
+        return np.zeros(len(params_list))
+    return np.nan_to_num(confidence([params.rmse for params in params_list],
+                                    [params.score for params in params_list], lam))
+
+
+class GridSearch(object):
+    """
+    This class purpose is to hold everything a scale x translate search session needs: the estimator, the search
+    space, the confidence weight, the results and the counters. No module state is used, so several sessions can
+    run in the same process, in threads or in worker processes independently.
+    """
+
+    def __init__(self, estimator=None, scale_factors=None, translate_factors=None, lam=0.3, budget=24, results=None,
+                 store=None, manifest=None, display_images=False, target_size=(432, 368), cache_path=None,
+                 upper_library=None, donor_index=None, donors=3):
+        """
+        Constructor
+        :param estimator: TfPoseEstimator, None creates the process wide one on first use
+        :param scale_factors: bottom scale factors, defaults to SCALE_FACTORS
+        :param translate_factors: upper translations in pixels, defaults to TRANSLATE_FACTORS
+        :param lam: confidence weight of the skeleton score (coarse to fine search)
+        :param budget: max inferences per pair (coarse to fine search)
+        :param results: list the OptimalParams are appended to
+        :param store: ResultStore the results are appended to as soon as each cell is done
+        :param manifest: JobManifest the completed cells are recorded in, cells already in it are skipped
+        :param display_images: write the merged images and their skeletons to ./images/hagit/
+        :param target_size: (width, height) of the network
+        :param cache_path: persistent inference cache file, None disables it (a given estimator is wrapped with it)
+        :param upper_library: UpperLibrary the fitted uppers are taken from, None fits them for every cell
+        :param donor_index: hips DonorIndex of the upper images, only the best donors of each bottom are searched
+        :param donors: number of upper images searched per bottom image with a donor index
+        """
+        if estimator is not None and cache_path and not isinstance(estimator, CachedEstimator):
+            # a given estimator reads and writes the cache too
+            estimator = cached_estimator(estimator, cache_path)
+        self._estimator = estimator
+        self.scale_factors = list(SCALE_FACTORS if scale_factors is None else scale_factors)
+        self.translate_factors = list(TRANSLATE_FACTORS if translate_factors is None else translate_factors)
+        self.lam = lam
+        self.budget = budget
+        self.results = [] if results is None else results
+        self.store = store
+        self.manifest = manifest
+        self.display_images = display_images
+        self.target_size = target_size
+        self.cache_path = cache_path
+        self.upper_library = upper_library
+        # merge buffers reused by every translation of the session
+        self.canvases = CanvasPool()
+        if donor_index is not None and donor_index.kind != 'hips':
+            raise ValueError("the upper images are searched with a hips donor index, not a {} one".format(
+                donor_index.kind))
+        self.donor_index = donor_index
+        self.donors = donors
+        # merged images index, names the displayed images
+        self.count = 1
+        self.inferences = 0
+        self.cells_done = 0
+
+    @property
+    def estimator(self):
+        if self._estimator is None:
+            self._estimator = cached_estimator(get_pose_estimator('mobilenet_thin', self.target_size),
+                                               self.cache_path)
+        return self._estimator
+
+    def config(self):
+        """
+        :return: the settings needed to rebuild an equivalent session in a worker process
+        """
+        return (tuple(self.scale_factors), tuple(self.translate_factors), self.lam, self.budget,
+                tuple(self.target_size), self.cache_path,
+                self.upper_library.folder if self.upper_library is not None else None)
+
+    def prepare(self, upper, bottom, factor):
+        """
+        :param upper: [image, name]
+        :param bottom: [image, name]
+        :param factor: bottom scale factor
+        :return: cropped upper affined image, scaled bottom image
+        """
+        return prepare_pair(upper[0], bottom[0], factor, self.upper_library, upper[1])
+
+    def translation(self, upper, upper_name, bottom, bottom_name, scale_factor, results=None, translate_factors=None):
+        """
+        Score the translations of a prepared (upper, bottom) pair
+        :param upper: cropped upper affined image
+        :param upper_name: upper image path
+        :param bottom: scaled bottom image
+        :param bottom_name: bottom image path
+        :param scale_factor: bottom scale factor
+        :param results: list to append the OptimalParams to, defaults to the session results
+        :param translate_factors: translations to score, defaults to the session ones
+        :return:
+        """
+        if results is None:
+            results = self.results
+        if translate_factors is None:
+            translate_factors = self.translate_factors
+        estimator = self.estimator
+        height_u, width_u, channels = upper.shape
+        height_b, width_b, channels = bottom.shape
+        scales = None
 
-def translation(estimator, upper, upper_name, bottom, bottom_name, scale_factor):
-    global count
-    height_u, width_u, channels = upper.shape
-    height_b, width_b, channels = bottom.shape
-    scales = None
-    for translate_factor in [0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50]:
         # merge between upper and bottom
-        # create original merged image for future use
-        min_orig = min(width_u, width_b)
-        orig_image = 255 * np.ones((height_u + height_b, min_orig, 3), np.uint8)
-        orig_image[0:height_u, :] = upper[:, 0:min_orig]
-        orig_image[height_u:height_u + height_b, :] = bottom[:, 0:min_orig]
-
-        pts1 = np.float32([[0, width_u],
-                           [height_u, 0],
-                           [height_u, width_u]])
-
-        pts2 = np.float32([[translate_factor, width_b],
-                           [translate_factor + height_b, 0],
-                           [translate_factor + height_b, width_b]])
-
-        translated_affined_image = create_affined_image(upper, pts1, pts2)
-        # if display_images:
-        #     path = './images/hagit/'
-        #     if not os.path.exists(path):
-        #         os.makedirs(path)
-        #     cv2.imwrite(r'{0}/translated_affined{1}.png'.format(path,count), translated_affined_image)
-        # cv2.imshow('affined result', translated_affined_image)
-        # cv2.waitKey()
-
-        # Merge the two images until the hip coordinate
-        height_u, width_u, channels = translated_affined_image.shape
-        minWidth = min(width_u, width_b)
-        merged_image = 255 * np.ones((height_u + height_b, minWidth, 3), np.uint8)
-        merged_image[0:height_u, :] = translated_affined_image[:, 0:minWidth]
-        merged_image[height_u:height_u + height_b, :] = bottom[:, 0:minWidth]
-        if display_images:
-            path = './images/hagit/'
-            if not os.path.exists(path):
-                os.makedirs(path)
-            cv2.imwrite(r'{0}/merged_image{1}.png'.format(path, count), merged_image)
-            # cv2.imshow('Merged Image', merged_image)
-            # cv2.waitKey()
-
-        # calculate the merged image skeleton
-        no_skeleton = False
-        merged_image_parts = estimator.inference(merged_image, scales=scales)
-        for pair_order, pair in enumerate(common.CocoPairsRender):
-            if merged_image_parts.__contains__(0) and (
-                    pair[0] not in merged_image_parts[0].body_parts.keys() or pair[1] not in merged_image_parts[ 0].body_parts.keys()):
-                no_skeleton = True
-                break
-        if not no_skeleton:
-            # draw skeleton on image
-            merged_image_skeleton = TfPoseEstimator.draw_humans(merged_image, merged_image_parts, imgcopy=True)
-            # present the skeleton
-            if display_images:
+        # create original merged image for future use, in a reused canvas
+        orig_image = stack_images(upper, bottom, self.canvases.get((height_u + height_b, min(width_u, width_b), 3)))
+
+        orig_image_parts = None
+
+        # all the translated merged images, stacked in a reused canvas
+        merged_images = list(translated_stack(upper, bottom, translate_factors, self.canvases))
+
+        # calculate all the merged images skeletons in a single network run
+        merged_images_parts = inference_batch(estimator, merged_images, scales=scales)
+        self.inferences += len(merged_images)
+
+        for translate_factor, merged_image, merged_image_parts in zip(translate_factors, merged_images,
+                                                                      merged_images_parts):
+            if self.display_images:
                 path = './images/hagit/'
                 if not os.path.exists(path):
                     os.makedirs(path)
-                cv2.imwrite(r'{0}/merged_person_result{1}.png'.format(path, count), merged_image_skeleton)
-                # cv2.imshow('merged person result', merged_image_skeleton)
+                cv2.imwrite(r'{0}/merged_image{1}.png'.format(path, self.count), merged_image)
+                # cv2.imshow('Merged Image', merged_image)
                 # cv2.waitKey()
 
-            # create original skeleton for comparision
-            orig_image_parts = estimator.inference(orig_image, scales=scales)
-            # gather all info for comparision
-            params = OptimalParams(merged_image_parts, orig_image_parts, translate_factor, scale_factor)
-            params.skeleton_image = merged_image_skeleton
-            params.has_skeleton = not no_skeleton
-            params.calculate_rmse()
-            params.calculate_skeleton_score(merged_image_parts)
-            params.upper = [upper_name, upper]
-            params.bottom = [bottom_name, bottom]
-            optimalParamsList.append(params)
-        cv2.destroyAllWindows()
-        count = count + 1
-
-
-def find_optimal_scaled_translated():
-    global count
+            no_skeleton = False
+            for pair_order, pair in enumerate(common.CocoPairsRender):
+                if merged_image_parts.__contains__(0) and (
+                        pair[0] not in merged_image_parts[0].body_parts.keys() or pair[1] not in merged_image_parts[ 0].body_parts.keys()):
+                    no_skeleton = True
+                    break
+            if not no_skeleton:
+                # present the skeleton
+                if self.display_images:
+                    # draw skeleton on image
+                    merged_image_skeleton = TfPoseEstimator.draw_humans(merged_image, merged_image_parts,
+                                                                        imgcopy=True)
+                    path = './images/hagit/'
+                    if not os.path.exists(path):
+                        os.makedirs(path)
+                    cv2.imwrite(r'{0}/merged_person_result{1}.png'.format(path, self.count), merged_image_skeleton)
+                    # cv2.imshow('merged person result', merged_image_skeleton)
+                    # cv2.waitKey()
+
+                # create original skeleton for comparision (it doesn't depend on the translation)
+                if orig_image_parts is None:
+                    orig_image_parts = original_skeleton(estimator, orig_image)
+                # gather all info for comparision
+                params = OptimalParams(merged_image_parts, orig_image_parts, translate_factor, scale_factor)
+                params.set_image_size(*merged_image.shape[:2])
+                params.has_skeleton = not no_skeleton
+                params.calculate_rmse()
+                params.calculate_skeleton_score(merged_image_parts)
+                params.upper = upper_name
+                params.bottom = bottom_name
+                results.append(params)
+            cv2.destroyAllWindows()
+            self.count = self.count + 1
+
+    def search_pair(self, upper, bottom, factor, results=None):
+        """
+        Score all the translations of a single (upper, bottom, scale) cell
+        :param upper: [image, name]
+        :param bottom: [image, name]
+        :param factor: bottom scale factor
+        :param results: list to append the OptimalParams to, defaults to the session results
+        :return:
+        """
+        upper_affined_image, scaled_bottom = self.prepare(upper, bottom, factor)
+        self.translation(upper_affined_image, upper[1], scaled_bottom, bottom[1], factor, results)
+
+    def search_pair_coarse_to_fine(self, upper, bottom, results=None):
+        """
+        Search a single (upper, bottom) pair without scoring the whole scale x translate grid.
+        A coarse grid is scored first, scales where no cell has a skeleton are pruned, then the cells around the best
+        one are refined until it stops moving or the inference budget is spent.
+        With the default factors the full grid costs 84 inferences (77 cells and 7 scaled pairs), the coarse grid 12
+        and a search usually ends after 18 to 24, 3.5 to 4.5 times fewer. The budget caps the refinement: a budget of
+        12 only scores the coarse grid (7 times fewer), a higher one gets closer to the exhaustive best.
+        :param upper: [image, name]
+        :param bottom: [image, name]
+        :param results: list to append the evaluated OptimalParams to, defaults to the session results
+        :return: number of inferences used
+        """
+        if results is None:
+            results = self.results
+        scale_factors = self.scale_factors
+        translate_factors = self.translate_factors
+        budget = self.budget
+        evaluated = {}
+        prepared = {}
+        used = [0]
+
+        def evaluate(cells):
+            by_scale = {}
+            for cell in cells:
+                if cell not in evaluated:
+                    by_scale.setdefault(cell[0], []).append(cell[1])
+            for si in sorted(by_scale):
+                # keep only the cells that fit in the remaining budget
+                by_scale[si] = by_scale[si][:max(0, budget - used[0] - (0 if si in prepared else 1))]
+                if not by_scale[si]:
+                    continue
+                cost = len(by_scale[si]) + (0 if si in prepared else 1)
+                if si not in prepared:
+                    prepared[si] = self.prepare(upper, bottom, scale_factors[si])
+                used[0] += cost
+                upper_affined_image, scaled_bottom = prepared[si]
+                cell_results = []
+                self.translation(upper_affined_image, upper[1], scaled_bottom, bottom[1], scale_factors[si],
+                                 cell_results, [translate_factors[ti] for ti in by_scale[si]])
+                for ti in by_scale[si]:
+                    evaluated[(si, ti)] = None
+                for params in cell_results:
+                    # cells without a single detected human have no RMSE and are pruned
+                    if not np.isnan(params.rmse):
+                        evaluated[(si, translate_factors.index(params.translate))] = params
+
+        def valid_cells():
+            return [(cell, params) for cell, params in sorted(evaluated.items()) if params is not None]
+
+        # coarse grid
+        coarse_scales = list(range(0, len(scale_factors), 3))
+        coarse_translates = list(range(0, len(translate_factors), 5))
+        evaluate([(si, ti) for si in coarse_scales for ti in coarse_translates])
+        pruned_scales = set(si for si in coarse_scales
+                            if all(evaluated.get((si, ti)) is None for ti in coarse_translates))
+
+        # local refinement around the best cell
+        best_cell = None
+        while True:
+            cells = valid_cells()
+            if not cells:
+                break
+            confidences = local_confidence([params for _, params in cells], self.lam)
+            cell = cells[int(np.argmax(confidences))][0]
+            if cell == best_cell:
+                break
+            best_cell = cell
+            neighbours = [(si, ti)
+                          for si in range(max(0, cell[0] - 1), min(len(scale_factors), cell[0] + 2))
+                          for ti in range(max(0, cell[1] - 2), min(len(translate_factors), cell[1] + 3))
+                          if si not in pruned_scales and (si, ti) not in evaluated]
+            if not neighbours or used[0] >= budget:
+                break
+            evaluate(neighbours)
+
+        results.extend(params for _, params in valid_cells())
+        return used[0]
+
+    def compare_with_exhaustive(self, upper, bottom, results=None):
+        """
+        Run both the exhaustive and the coarse to fine search on a pair and compare the best confidences,
+        both normalized over the exhaustive grid
+        :param upper: [image, name]
+        :param bottom: [image, name]
+        :param results: list to append the coarse to fine OptimalParams to, None drops them
+        :return: (exhaustive best confidence, coarse to fine best confidence, coarse to fine inferences,
+                  exhaustive inferences)
+        """
+        exhaustive = []
+        for factor in self.scale_factors:
+            self.search_pair(upper, bottom, factor, exhaustive)
+        exhaustive = [params for params in exhaustive if not np.isnan(params.rmse)]
+        found = []
+        used = self.search_pair_coarse_to_fine(upper, bottom, found)
+        if results is not None:
+            results.extend(found)
+        confidences = local_confidence(exhaustive, self.lam)
+        by_cell = dict(((params.scale, params.translate), value)
+                       for params, value in zip(exhaustive, confidences))
+        found_best = max(by_cell.get((params.scale, params.translate), -np.inf)
+                         for params in found) if found else -np.inf
+        exhaustive_best = max(confidences) if len(confidences) else -np.inf
+        return exhaustive_best, found_best, used, len(self.scale_factors) * (len(self.translate_factors) + 1)
+
+    def select_pairs(self, upper_images, bottom_images):
+        """
+        Pick the upper images whose hips fit each bottom image's hips
+        :param upper_images: list of [image, path]
+        :param bottom_images: list of [image, path]
+        :return: set of (upper path, bottom path)
+        """
+        # restrict the index to the searched uppers once, not on every query
+        donor_index = self.donor_index.subset([upper_path for _, upper_path in upper_images])
+        pairs = set()
+        for bottom_image, bottom_path in bottom_images:
+            skeleton = Skeleton.best(original_skeleton(self.estimator, bottom_image))
+            for upper_path, _ in donor_index.query_skeleton(skeleton, bottom_image.shape, self.donors):
+                pairs.add((upper_path, bottom_path))
+        return pairs
+
+    def donor_recall(self, upper_images, bottom_images, pairs, search='grid'):
+        """
+        Check the picked pairs against the exhaustive ones: search every upper with every bottom and count the
+        bottoms whose best upper (highest confidence) is one of their picked donors
+        :param upper_images: list of [image, path]
+        :param bottom_images: list of [image, path]
+        :param pairs: set of (upper path, bottom path) picked by select_pairs
+        :param search: 'grid' or 'coarse', the search used for every pair
+        :return: fraction of the bottoms whose best upper was picked, None if no bottom has a result
+        """
+        picked = 0
+        searched = 0
+        for bottom in bottom_images:
+            results = []
+            for upper in upper_images:
+                if search == 'coarse':
+                    self.search_pair_coarse_to_fine(upper, bottom, results)
+                else:
+                    for factor in self.scale_factors:
+                        self.search_pair(upper, bottom, factor, results)
+            results = [params for params in results if not np.isnan(params.rmse)]
+            if not results:
+                continue
+            best_upper = results[int(np.argmax(local_confidence(results, self.lam)))].upper[1]
+            found = (best_upper, bottom[1]) in pairs
+            searched += 1
+            picked += found
+            print("{}: best upper {} {}".format(os.path.basename(bottom[1]), os.path.basename(best_upper),
+                                                'picked' if found else 'missed'))
+        if searched == 0:
+            return None
+        print("Donor recall: {}/{} bottoms with {} of {} uppers".format(picked, searched, self.donors,
+                                                                       len(upper_images)))
+        return picked / float(searched)
+
+    def _manifest_cells(self, upper_path, bottom_path, factor):
+        # a coarse search pair is recorded as a single cell without scale and translation
+        if factor is None:
+            return [(upper_path, bottom_path, None, None)]
+        return [(upper_path, bottom_path, factor, translate_factor) for translate_factor in self.translate_factors]
+
+    def _save(self, upper_path, bottom_path, factor, results):
+        self.cells_done += 1
+        if self.store is not None:
+            self.store.append(results, 'coarse' if factor is None else 'grid')
+        if self.manifest is not None:
+            self.manifest.mark_cells(self._manifest_cells(upper_path, bottom_path, factor))
+
+    def run(self, upper_images, bottom_images, workers=1, search='grid', verify=False, resume=False):
+        """
+        Search the scale and translate params of every upper x bottom combination
+        :param upper_images: list of [image, path]
+        :param bottom_images: list of [image, path]
+        :param workers: number of worker processes, 1 runs the search in the current process
+        :param search: 'grid' scores every scale x translate cell, 'coarse' runs the coarse to fine search
+        :param verify: print the coarse to fine best confidence against the exhaustive grid per pair, and the donor
+                       recall against all the pairs with a donor index (serial only)
+        :param resume: load the store's results of the same search mode and skip the cells they complete
+        :return: the session results
+        """
+        factors = [None] if search == 'coarse' else self.scale_factors
+        manifest = self.manifest
+
+        completed = set()
+        if self.store is not None and resume:
+            # a grid cell is only done with all its translations, the rows of an incomplete one are searched again
+            completed = self.store.completed_cells(search, self.translate_factors)
+            self.results.extend(self.store.load_params(search, completed))
+
+        def is_done(upper_path, bottom_path, factor):
+            if (upper_path, bottom_path, factor) in completed:
+                return True
+            return manifest is not None and all(manifest.is_cell_done(cell)
+                                                for cell in self._manifest_cells(upper_path, bottom_path, factor))
+
+        pairs = None if self.donor_index is None else self.select_pairs(upper_images, bottom_images)
+        if verify and pairs is not None:
+            self.donor_recall(upper_images, bottom_images, pairs, search)
+        cells = [(upper, bottom, factor) for upper in upper_images for bottom in bottom_images for factor in factors
+                 if (pairs is None or (upper[1], bottom[1]) in pairs) and not is_done(upper[1], bottom[1], factor)]
+        if workers <= 1:
+            for upper, bottom, factor in cells:
+                results = []
+                if factor is not None:
+                    self.search_pair(upper, bottom, factor, results)
+                elif verify:
+                    exhaustive_best, found_best, used, total = self.compare_with_exhaustive(upper, bottom, results)
+                    print("{} + {}: confidence {:.3f} (exhaustive {:.3f}) with {}/{} inferences".format(
+                        os.path.basename(upper[1]), os.path.basename(bottom[1]), found_best, exhaustive_best,
+                        used, total))
+                    # a verify run is a measurement, its pairs are not stored nor marked as done
+                    self.results.extend(results)
+                    continue
+                else:
+                    self.search_pair_coarse_to_fine(upper, bottom, results)
+                self.results.extend(results)
+                self._save(upper[1], bottom[1], factor, results)
+            if isinstance(self._estimator, CachedEstimator):
+                print(self._estimator.cache)
+            if self.upper_library is not None:
+                print(self.upper_library)
+            return self.results
+
+        units = [(upper[1], bottom[1], factor, self.config()) for upper, bottom, factor in cells]
+        del cells
+        # TF sessions are not fork safe: once a graph is loaded here (the donor index picks the pairs with the
+        # estimator) the workers are started fresh instead of forked
+        mp_context = None
+        if self.donor_index is not None or model_registry.any_loaded():
+            mp_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+            futures = [executor.submit(_search_work_unit, unit) for unit in units]
+            future_units = dict(zip(futures, units))
+            for done, future in enumerate(as_completed(futures), 1):
+                unit = future_units[future]
+                self._save(unit[0], unit[1], unit[2], future.result())
+                print("Completed {}/{} work units".format(done, len(units)))
+            # collect in submission order so the results are the same as the serial search
+            for future in futures:
+                self.results.extend(future.result())
+        return self.results
+
+
+# per worker process state of the parallel grid search
+_worker_searches = {}
+_worker_images = {}
+
+
+def _search_work_unit(unit):
+    """
+    Run a single work unit inside a worker process
+    :param unit: (upper path, bottom path, scale factor, GridSearch config), a None scale factor runs the coarse
+                 to fine search over the whole pair
+    :return: list of OptimalParams
+    """
+    upper_path, bottom_path, factor, config = unit
+    if config not in _worker_searches:
+        # one session per worker process and configuration, created on its first work unit
+        scale_factors, translate_factors, lam, budget, target_size, cache_path, library_folder = config
+        upper_library = UpperLibrary(library_folder) if library_folder is not None else None
+        _worker_searches[config] = GridSearch(scale_factors=scale_factors, translate_factors=translate_factors,
+                                              lam=lam, budget=budget, target_size=target_size,
+                                              cache_path=cache_path, upper_library=upper_library)
+    search = _worker_searches[config]
+    for path in (upper_path, bottom_path):
+        if path not in _worker_images:
+            _worker_images[path] = cv2.imread(path)
+    upper = [_worker_images[upper_path], upper_path]
+    bottom = [_worker_images[bottom_path], bottom_path]
+    results = []
+    if factor is None:
+        search.search_pair_coarse_to_fine(upper, bottom, results)
+    else:
+        search.search_pair(upper, bottom, factor, results)
+    return results
+
+
+def find_optimal_scaled_translated(workers=1, search='grid', lam=0.3, budget=24, verify=False, cache_path=None,
+                                   store=None, resume=False, manifest=None, library_folder=None, donor_index_path=None,
+                                   donors=3):
+    """
+    Search the scale and translate params of every upper x bottom image in ./images
+    :param workers: number of worker processes, 1 runs the search in the current process
+    :param search: 'grid' scores every scale x translate cell, 'coarse' runs the coarse to fine search
+    :param lam: confidence weight of the skeleton score (coarse to fine search)
+    :param budget: max inferences per pair (coarse to fine search)
+    :param verify: print the coarse to fine best confidence against the exhaustive grid per pair, and the donor
+                   recall against all the pairs with a donor index (serial only)
+    :param cache_path: persistent inference cache file, None disables it
+    :param store: ResultStore the results are appended to as soon as each cell is done
+    :param resume: load the store's results and skip the cells already in it
+    :param manifest: JobManifest the completed cells are recorded in, cells already in it are skipped
+    :param library_folder: UpperLibrary folder, None fits the uppers for every cell
+    :param donor_index_path: hips DonorIndex file of the upper images, None searches every upper x bottom pair
+    :param donors: number of upper images searched per bottom image with a donor index
+    :return: list of OptimalParams
+    """
     # get pre-process bounding boxes of bottom parts
     with open('human_points.pickle', 'rb') as handle:
         bboxes_bottom = pickle.load(handle)
     # read upper and bottom images
     uppper_images = video_utils.load_images_from_folder("./images/upper/", True)
     bottom_images = video_utils.load_images_from_folder("./images/bottom/", True)
-    w = 432
-    h = 368
-    # create OpenPose estimator
-    estimator = TfPoseEstimator(get_graph_path('mobilenet_thin'), target_size=(w, h))
-    for upper in uppper_images:
-        for bottom in bottom_images:
-            for factor in [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]:
-                # merge between upper and bottom
-                # create affined image
-                height_u, width_u, channels = upper[0].shape
-
-                pts1 = np.float32([[0, width_u],
-                                   [height_u, 0],
-                                   [height_u, width_u]])
-
-                height_b, width_b, channels = bottom[0].shape
-                # if display_images:
-                # path = './images/hagit/'
-                # if not os.path.exists(path):
-                #     os.makedirs(path)
-                # cv2.imwrite(r'{0}/bottom_result{1}.png'.format(path,count),bottom[0])
-                # cv2.imshow('bottom result', bottom[0])
-                # cv2.waitKey()
-                # Scale down and pad
-                scaled_bottom = cv2.resize(bottom[0], (int(width_b * factor), int(height_b * factor)), fx=factor,
-                                           fy=factor, interpolation=cv2.INTER_AREA)
-                height_b, width_b, channels = scaled_bottom.shape
-
-                # pts2 = []
-                # for item in bboxes_bottom:
-                #     if item[0] == bottom[1] and item[1] == factor:
-                #         pts2 = item[2]
-                # if pts2.size == 0:
-                pts2 = np.float32([[0, width_b],
-                                   [height_b, 0],
-                                   [height_b, width_b]])
-
-                # if display_images:
-                #     path = './images/hagit/'
-                #     if not os.path.exists(path):
-                #         os.makedirs(path)
-                #     cv2.imwrite(r'{0}/scaled_bottom_result{1}.png'.format(path,count), scaled_bottom)
-                # cv2.imshow('scaled bottom result', scaled_bottom)
-                # cv2.waitKey()
-
-                upper_affined_image = create_affined_image(upper[0], pts1, pts2)
-                # if display_images:
-                #     path = './images/hagit/'
-                #     if not os.path.exists(path):
-                #         os.makedirs(path)
-                #     cv2.imwrite(r'{0}/upper_affined_result_#1_{1}.png'.format(path, count), upper_affined_image)
-                # cv2.imshow('affined result #1', upper_affined_image)
-                # cv2.waitKey()
-
-                # remove black pixel from affined image
-                # 1 Convert image into grayscale, and make in binary image for threshold value of 1.
-                gray = cv2.cvtColor(upper_affined_image, cv2.COLOR_BGR2GRAY)
-                ret, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-                # 2  Find contours in image. There will be only one object, so find bounding rectangle for it
-                image, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                cnt = contours[0]
-                # 3 Crop image and save it to another one
-                x, y, w, h = cv2.boundingRect(cnt)
-                upper_affined_image = upper_affined_image[y:y + h, x:x + w].copy()
-                # if display_images:
-                #     path = './images/hagit/'
-                #     if not os.path.exists(path):
-                #         os.makedirs(path)
-                #     cv2.imwrite(r'{0}/upper_affined_result_#2_{1}.png'.format(path,count), upper_affined_image)
-                # cv2.imshow('affined result #2', upper_affined_image)
-                # cv2.waitKey()
-
-                translation(estimator, upper_affined_image, upper[1], scaled_bottom, bottom[1], factor)
-
-
-def normalize(values):
-    """
-    Scale to a 0 mean and unit variance
-    :param values:
-    :return:
-    """
-    x = np.asarray(values)
-    res = (x - x.mean()) / x.std()
-    return res
+    upper_library = UpperLibrary(library_folder) if library_folder is not None else None
+    donor_index = DonorIndex.load(donor_index_path) if donor_index_path is not None else None
+    grid_search = GridSearch(lam=lam, budget=budget, store=store, manifest=manifest, target_size=(432, 368),
+                             cache_path=cache_path, upper_library=upper_library, donor_index=donor_index,
+                             donors=donors)
+    return grid_search.run(uppper_images, bottom_images, workers, search, verify, resume)
 
 
-count = 1
 if __name__ == '__main__':
     # this main find the optimal scale and translate params based on calculated confidence
-    display_images = False
-    optimalParamsList = []
+    parser = argparse.ArgumentParser(description='find optimal scale and translate params')
+    parser.add_argument('--workers', type=int, default=1, help='number of grid search worker processes')
+    parser.add_argument('--search', type=str, default='grid', help='grid / coarse')
+    parser.add_argument('--budget', type=int, default=24,
+                        help='max inferences per pair for the coarse search (of 84 for the full grid, the coarse '
+                             'grid alone costs 12)')
+    parser.add_argument('--verify', action='store_true',
+                        help='compare the coarse search with the exhaustive grid per pair, and the donors picked by '
+                             'the donor index with the best uppers of all the pairs')
+    parser.add_argument('--cache', type=str, default=None, help='persistent inference cache file')
+    parser.add_argument('--results', type=str, default='./results', help='result store folder')
+    parser.add_argument('--resume', action='store_true', help='skip the cells already in the result store')
+    parser.add_argument('--restart', action='store_true', help='drop the stored results and progress first')
+    parser.add_argument('--library', type=str, default='./upper_library',
+                        help='folder of the fitted upper images, shared by all the runs')
+    parser.add_argument('--donor-index', type=str, default=None,
+                        help='hips donor index of the upper images (see donor_index.py), only the best uppers of each '
+                             'bottom are searched')
+    parser.add_argument('--donors', type=int, default=3, help='uppers searched per bottom with a donor index')
+    parser.add_argument('--excel', type=str, default=None, help='export the results to this Excel file')
+    args = parser.parse_args()
     lam = 0.3
-    find_optimal_scaled_translated()
-    upper_names = []
-    bottom_names = []
-    scores = []
-    rmses = []
-    confidences = []
-    scales = []
-    translations = []
-    for params in optimalParamsList:
-        bottom_names.append(params.bottom[0])
-        upper_names.append(params.upper[0])
-        rmses.append(params.rmse)
-        scores.append(params.score)
-        scales.append(params.scale)
-        translations.append(params.translate)
-
-    print("Mean of RMSEs:{}".format(sum(rmses) / float(len(rmses))))
-    rmses_normalized = normalize(rmses)
-    scores_normalized = normalize(scores)
-    confidences.append((1 - lam) * rmses_normalized + lam * scores_normalized)
-
-    writer = pd.ExcelWriter('results.xlsx')
-    df = DataFrame(
-        {'Bottom Sample ID': Series(bottom_names), 'Upper Sample ID': Series(upper_names), 'Scale': Series(scales),
-         'Translations': Series(translations), 'RMSE': Series(rmses), 'Sum Of OpenPose Skeleton Joints': Series(scores),
-         'Dvir\'s Confidence Score': Series(confidences[0])})
-    df.to_excel(writer, sheet_name='partial-open-pose', index=False)
-    df = DataFrame({'Bottom': Series(list(set(bottom_names))), 'Upper': Series(list(set(upper_names)))})
-    df.to_excel(writer, sheet_name='Images', index=False)
-    writer.save()
-
-    max_index, max_value = max(enumerate(confidences[0]), key=operator.itemgetter(1))
+    store = ResultStore(args.results)
+    manifest = JobManifest(os.path.join(args.results, 'manifest.jsonl'))
+    if args.restart:
+        store.clear()
+        manifest.clear()
+    # the stored progress is only valid for the settings it was made with
+    settings = {'search': args.search, 'budget': args.budget, 'library': args.library,
+                'donor_index': args.donor_index, 'donors': args.donors}
+    if len(manifest) > 0 and manifest.metadata.get('settings') != settings:
+        print("The results in {} were made with other settings ({}), rerun with --restart to drop them".format(
+            args.results, manifest.metadata.get('settings')))
+        exit(1)
+    if manifest.metadata.get('settings') != settings:
+        manifest.set_metadata(settings=settings)
+    # rerunning an interrupted job continues where it stopped
+    resume = args.resume or len(manifest) > 0
+    optimalParamsList = find_optimal_scaled_translated(args.workers, args.search, lam, args.budget, args.verify,
+                                                       args.cache, store, resume, manifest, args.library,
+                                                       args.donor_index, args.donors)
+    store.close()
+    if not optimalParamsList:
+        print("No results")
+        exit()
+
+    # score the whole candidate set at once from the stacked skeletons
+    columns = params_columns(optimalParamsList)
+    rmses, scores, confidences = score_columns(columns, lam)
+
+    print("Mean of RMSEs:{}".format(rmses.mean()))
+
+    if args.excel:
+        export_excel(columns, args.excel, lam)
+
+    max_index, max_value = max(enumerate(confidences), key=operator.itemgetter(1))
     max_item = optimalParamsList[max_index]
     print("Scale: {0} Translate: {1} ".format(max_item.scale, max_item.translate))
-    cv2.imshow("Best Confidence Skeleton", max_item.skeleton_image)
+    # only the best candidate's image is needed, regenerate it instead of keeping every image during the search
+    estimator = cached_estimator(get_pose_estimator('mobilenet_thin', (432, 368)), args.cache)
+    cv2.imshow("Best Confidence Skeleton", render_candidate(estimator, max_item))
     cv2.waitKey()
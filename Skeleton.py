@@ -0,0 +1,171 @@
+import cv2
+import numpy as np
+
+import common
+from estimator import BodyPart, Human
+
+PARTS_COUNT = common.CocoPart.Background.value
+
+
+class Skeleton(object):
+    """
+    This class purpose is to hold a single human's body parts as arrays instead of per part objects:
+    an (18, 3) float32 array of x, y, score and a validity mask per part
+    """
+    __slots__ = ('points', 'mask')
+
+    def __init__(self, points=None, mask=None):
+        """
+        Constructor
+        :param points: (18, 3) array of normalized x, y and score
+        :param mask: (18,) bool array, True where the part was detected
+        """
+        self.points = np.zeros((PARTS_COUNT, 3), np.float32) if points is None else points
+        self.mask = np.zeros(PARTS_COUNT, np.bool_) if mask is None else mask
+
+    @classmethod
+    def from_human(cls, human):
+        """
+        Convert the estimator's Human
+        :param human:
+        :return: Skeleton
+        """
+        skeleton = cls()
+        for part_idx, body_part in human.body_parts.items():
+            skeleton.points[part_idx] = (body_part.x, body_part.y, body_part.score)
+            skeleton.mask[part_idx] = True
+        return skeleton
+
+    @classmethod
+    def from_humans(cls, humans):
+        """
+        :param humans:
+        :return: list of Skeleton
+        """
+        return [cls.from_human(human) for human in humans]
+
+    @classmethod
+    def single(cls, humans):
+        """
+        Skeleton of the only human found, an empty skeleton when there are none or several humans
+        :param humans: list of Human or Skeleton
+        :return: Skeleton
+        """
+        if len(humans) != 1:
+            return cls()
+        return humans[0] if isinstance(humans[0], Skeleton) else cls.from_human(humans[0])
+
+    @classmethod
+    def best(cls, humans):
+        """
+        Skeleton of the human with the highest sum of part scores
+        :param humans: list of Human or Skeleton
+        :return: Skeleton or None if no human has a positive score
+        """
+        skeletons = [human if isinstance(human, Skeleton) else cls.from_human(human) for human in humans]
+        best = None
+        best_score = 0
+        for skeleton in skeletons:
+            score = skeleton.score_sum()
+            if score > best_score:
+                best = skeleton
+                best_score = score
+        return best
+
+    @property
+    def x(self):
+        return self.points[:, 0]
+
+    @property
+    def y(self):
+        return self.points[:, 1]
+
+    @property
+    def score(self):
+        return self.points[:, 2]
+
+    def has_parts(self, parts):
+        """
+        :param parts: part indices
+        :return: True if all the given parts were detected
+        """
+        return bool(self.mask[list(parts)].all())
+
+    def score_sum(self, parts=None):
+        """
+        Sum the scores of the detected parts
+        :param parts: part indices, None for all the parts
+        :return:
+        """
+        mask = self.mask if parts is None else self.mask[list(parts)]
+        scores = self.score if parts is None else self.score[list(parts)]
+        return float(scores[mask].sum())
+
+    def to_human(self):
+        """
+        Convert back to the estimator's Human (for code that needs the original objects)
+        :return: Human
+        """
+        human = Human([])
+        for part_idx in np.flatnonzero(self.mask):
+            x, y, score = self.points[part_idx]
+            human.body_parts[part_idx] = BodyPart('0-%d' % part_idx, part_idx, float(x), float(y), float(score))
+        return human
+
+    def copy(self):
+        return Skeleton(self.points.copy(), self.mask.copy())
+
+
+def stack(skeletons):
+    """
+    Stack skeletons into arrays
+    :param skeletons: list of Skeleton
+    :return: (n, 18, 3) points, (n, 18) mask
+    """
+    points = np.zeros((len(skeletons), PARTS_COUNT, 3), np.float32)
+    mask = np.zeros((len(skeletons), PARTS_COUNT), np.bool_)
+    for i, skeleton in enumerate(skeletons):
+        points[i] = skeleton.points
+        mask[i] = skeleton.mask
+    return points, mask
+
+
+def unstack(points, mask):
+    """
+    Split stacked arrays back into skeletons
+    :param points: (n, 18, 3)
+    :param mask: (n, 18)
+    :return: list of Skeleton
+    """
+    return [Skeleton(points[i], mask[i]) for i in range(points.shape[0])]
+
+
+def draw_skeleton(npimg, skeleton, imgcopy=False):
+    """
+    Draw skeleton on image
+    :param npimg:
+    :param skeleton: Skeleton, nothing is drawn for None
+    :param imgcopy:
+    :return:
+    """
+    if imgcopy:
+        npimg = np.copy(npimg)
+    if skeleton is None:
+        return npimg
+    image_h, image_w = npimg.shape[:2]
+    centers = {}
+
+    # draw point
+    for i in np.flatnonzero(skeleton.mask):
+        center = (int(skeleton.x[i] * image_w + 0.5), int(skeleton.y[i] * image_h + 0.5))
+        centers[i] = center
+        cv2.circle(npimg, center, 3, common.CocoColors[i], thickness=3, lineType=8, shift=0)
+
+    # draw line
+    for pair_order, pair in enumerate(common.CocoPairsRender):
+        if pair[0] not in centers or pair[1] not in centers:
+            continue
+
+        npimg = cv2.line(npimg, centers[pair[0]], centers[pair[1]], common.CocoColors[pair_order], 3)
+
+    return npimg
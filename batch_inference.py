@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+from estimator import PoseEstimator
+
+
+def _supports_batch(estimator):
+    """
+    Check if the estimator exposes the network tensors and session needed for a batched run
+    :param estimator:
+    :return: True if a single sess.run can be done over stacked images
+    """
+    return all(hasattr(estimator, name) for name in ('persistent_sess', 'tensor_image', 'tensor_output',
+                                                     'target_size'))
+
+
+def _prepare_image(estimator, npimg):
+    """
+    Apply the same preprocessing as TfPoseEstimator.inference does for a single image without scales
+    :param estimator:
+    :param npimg:
+    :return: network input image
+    """
+    if estimator.tensor_image.dtype.name == 'quint8':
+        # quantize input image
+        npimg = estimator._quantize_img(npimg)
+    if npimg.shape[:2] != (estimator.target_size[1], estimator.target_size[0]):
+        npimg = cv2.resize(npimg, estimator.target_size)
+    return npimg
+
+
+def inference_batch(estimator, images, scales=None):
+    """
+    Find the skeletons of several images with a single network run
+    :param estimator: TfPoseEstimator (or any object with the same inference interface)
+    :param images: list of images, they are resized to the estimator's target size
+    :param scales: multi scale inference is not batched, images are then inferred one by one
+    :return: list of humans per image
+    """
+    if len(images) == 0:
+        return []
+    if hasattr(estimator, 'inference_batch'):
+        return estimator.inference_batch(images, scales=scales)
+    if scales not in (None, [None]) or not _supports_batch(estimator):
+        return [estimator.inference(image, scales=scales) for image in images]
+
+    rois = np.stack([_prepare_image(estimator, image) for image in images])
+    output = estimator.persistent_sess.run(estimator.tensor_output, feed_dict={estimator.tensor_image: rois})
+    heat_mats = output[:, :, :, :19]
+    paf_mats = output[:, :, :, 19:]
+    humans_list = []
+    for heat_mat, paf_mat in zip(heat_mats, paf_mats):
+        # single scale inference keeps only the positive heat values
+        humans_list.append(PoseEstimator.estimate(np.maximum(heat_mat, 0), paf_mat))
+    return humans_list
+
+
+def batched(items, batch_size):
+    """
+    Group items into lists of batch_size (the last one may be shorter)
+    :param items: iterable
+    :param batch_size:
+    :return: generator of lists
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
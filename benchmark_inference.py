@@ -0,0 +1,115 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from batch_inference import inference_batch
+from estimator import PoseEstimator
+
+
+class StandInTensor(object):
+    """
+    Stand-in for a graph tensor, only its dtype is read by the inference code
+    """
+
+    class DType(object):
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, name, dtype='float32'):
+        self.name = name
+        self.dtype = StandInTensor.DType(dtype)
+
+
+class StandInSession(object):
+    """
+    Stand-in for the estimator's tf.Session. Every run pays a fixed dispatch overhead plus a per-image cost, which
+    is what batching saves on.
+    """
+
+    def __init__(self, run_overhead=0.01, channels=57):
+        """
+        Constructor
+        :param run_overhead: seconds spent per network run regardless of the batch size
+        :param channels: number of output maps (heat + paf)
+        """
+        self.run_overhead = run_overhead
+        # small weights keep the heat maps below the part threshold, so the post processing stays cheap
+        self.weights = np.random.rand(3, channels).astype(np.float32) / (255 * 3 * 10)
+        self.runs = 0
+
+    def run(self, fetches, feed_dict):
+        self.runs += 1
+        time.sleep(self.run_overhead)
+        images = np.asarray(list(feed_dict.values())[0], np.float32)
+        # the network output is 8 times smaller than its input
+        return np.dot(images[:, ::8, ::8], self.weights)
+
+
+class StandInEstimator(object):
+    """
+    Stand-in for TfPoseEstimator with the same session, tensors and target size, so batch_inference takes the
+    same batched path it takes with the real network.
+    """
+
+    def __init__(self, target_size=(432, 368), run_overhead=0.01, channels=57):
+        """
+        Constructor
+        :param target_size: (width, height) of the network input
+        :param run_overhead: seconds spent per network run regardless of the batch size
+        :param channels: number of output maps (heat + paf)
+        """
+        self.target_size = target_size
+        self.persistent_sess = StandInSession(run_overhead, channels)
+        self.tensor_image = StandInTensor('image')
+        self.tensor_output = StandInTensor('Openpose/concat_stage7')
+
+    @property
+    def runs(self):
+        return self.persistent_sess.runs
+
+    def inference(self, npimg, scales=None):
+        # the single image path of TfPoseEstimator.inference without scales
+        if npimg.shape[:2] != (self.target_size[1], self.target_size[0]):
+            npimg = cv2.resize(npimg, self.target_size)
+        output = self.persistent_sess.run(self.tensor_output, feed_dict={self.tensor_image: [npimg]})
+        heat_mat, paf_mat = output[0, :, :, :19], output[0, :, :, 19:]
+        return PoseEstimator.estimate(np.maximum(heat_mat, 0), paf_mat)
+
+
+def benchmark(estimator, images, batch_size):
+    """
+    Measure throughput of per image and batched inference
+    :param estimator:
+    :param images:
+    :param batch_size:
+    :return: (per image fps, batched fps)
+    """
+    start_time = time.time()
+    for image in images:
+        estimator.inference(image, scales=None)
+    single_time = time.time() - start_time
+
+    start_time = time.time()
+    for i in range(0, len(images), batch_size):
+        inference_batch(estimator, images[i:i + batch_size], scales=None)
+    batch_time = time.time() - start_time
+    return len(images) / single_time, len(images) / batch_time
+
+
+if __name__ == '__main__':
+    # This main compares per image and batched inference throughput on a stand-in estimator
+    parser = argparse.ArgumentParser(description='batched inference benchmark')
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--run-overhead', type=float, default=0.01, help='seconds per network run')
+    args = parser.parse_args()
+
+    w = 432
+    h = 368
+    estimator = StandInEstimator(target_size=(w, h), run_overhead=args.run_overhead)
+    images = [np.random.randint(0, 255, (h * 2, w, 3), np.uint8) for _ in range(args.images)]
+    single_fps, batch_fps = benchmark(estimator, images, args.batch_size)
+    print("Per image: {:.1f} images/sec".format(single_fps))
+    print("Batch of {}: {:.1f} images/sec ({:.1f}x)".format(args.batch_size, batch_fps, batch_fps / single_fps))
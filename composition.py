@@ -0,0 +1,209 @@
+import cv2
+import numpy as np
+
+# affine transform classes, from the cheapest to apply
+IDENTITY = 'identity'
+TRANSLATION = 'translation'
+SCALE_TRANSLATION = 'scale_translation'
+AFFINE = 'affine'
+
+
+class CanvasPool(object):
+    """
+    This class purpose is to reuse the image buffers of the merge step instead of allocating new ones per image.
+    A buffer is kept per shape, so a canvas is only valid until the next get of the same shape.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, shape, fill=None):
+        """
+        :param shape: canvas shape
+        :param fill: value to fill the canvas with, None leaves the previous content
+        :return: uint8 canvas
+        """
+        shape = tuple(shape)
+        buffer = self._buffers.get(shape)
+        if buffer is None:
+            buffer = np.empty(shape, np.uint8)
+            self._buffers[shape] = buffer
+        if fill is not None:
+            buffer.fill(fill)
+        return buffer
+
+    def __len__(self):
+        return len(self._buffers)
+
+
+class CanvasRing(object):
+    """
+    This class purpose is to reuse the image buffers of a stream of frames. A fixed number of canvases of one shape
+    are handed out in turn, so a canvas is only valid until count more are taken: count must cover every frame
+    still in use (e.g. all the frames a pipeline can hold at once).
+    """
+
+    def __init__(self, shape, count):
+        """
+        Constructor
+        :param shape: canvas shape
+        :param count: number of canvases
+        """
+        self._canvases = np.zeros((count,) + tuple(shape), np.uint8)
+        self._next = 0
+
+    def get(self):
+        """
+        :return: the next uint8 canvas, with the content it had when it was last used
+        """
+        canvas = self._canvases[self._next]
+        self._next = (self._next + 1) % len(self._canvases)
+        return canvas
+
+    def __len__(self):
+        return len(self._canvases)
+
+
+def stack_images(top, bottom, out=None):
+    """
+    Put the top image above the bottom image, both cut to the narrowest width
+    :param top:
+    :param bottom:
+    :param out: canvas of shape (top height + bottom height, min width, 3) to write to, None allocates one
+    :return: stacked image
+    """
+    height_t, width_t = top.shape[:2]
+    height_b, width_b = bottom.shape[:2]
+    min_width = min(width_t, width_b)
+    if out is None:
+        out = np.empty((height_t + height_b, min_width, 3), np.uint8)
+    out[0:height_t] = top[:, 0:min_width]
+    out[height_t:height_t + height_b] = bottom[:, 0:min_width]
+    return out
+
+
+def classify_affine(matrix, eps=1e-6):
+    """
+    :param matrix: 2x3 affine transform
+    :param eps: tolerance
+    :return: IDENTITY, TRANSLATION, SCALE_TRANSLATION (axis aligned scale) or AFFINE
+    """
+    matrix = np.asarray(matrix, np.float64)
+    if abs(matrix[0, 1]) > eps or abs(matrix[1, 0]) > eps:
+        return AFFINE
+    if abs(matrix[0, 0] - 1) > eps or abs(matrix[1, 1] - 1) > eps:
+        return SCALE_TRANSLATION
+    if abs(matrix[0, 2]) > eps or abs(matrix[1, 2]) > eps:
+        return TRANSLATION
+    return IDENTITY
+
+
+def column_shifts(matrices, eps=1e-6):
+    """
+    Check if the transforms only differ by whole pixel horizontal shifts
+    :param matrices: list of 2x3 affine transforms
+    :param eps: tolerance
+    :return: int array of the shifts relative to the first transform, None if they differ otherwise
+    """
+    first = np.asarray(matrices[0], np.float64)
+    shifts = []
+    for matrix in matrices:
+        delta = np.asarray(matrix, np.float64) - first
+        shift = int(round(delta[0, 2]))
+        if np.abs(delta[:, :2]).max() > eps or abs(delta[1, 2]) > eps or abs(delta[0, 2] - shift) > eps:
+            return None
+        shifts.append(shift)
+    return np.array(shifts, np.int64)
+
+
+def shift_image(image, dx, dy, width, height, out=None):
+    """
+    Translate an image by whole pixels without warping, the uncovered area is black
+    :param image:
+    :param dx: columns shift
+    :param dy: rows shift
+    :param width: output width
+    :param height: output height
+    :param out: (height, width, 3) array to write to, None allocates one
+    :return: shifted image
+    """
+    if out is None:
+        out = np.empty((height, width) + image.shape[2:], np.uint8)
+    out.fill(0)
+    src_h, src_w = image.shape[:2]
+    top, left = max(dy, 0), max(dx, 0)
+    bottom, right = min(dy + src_h, height), min(dx + src_w, width)
+    if bottom > top and right > left:
+        out[top:bottom, left:right] = image[top - dy:bottom - dy, left - dx:right - dx]
+    return out
+
+
+def translate_matrices(upper_shape, bottom_shape, translate_factors):
+    """
+    Affine transforms fitting the upper image to the bottom's size, translated by each factor
+    :param upper_shape:
+    :param bottom_shape:
+    :param translate_factors: translations in pixels
+    :return: list of 2x3 matrices
+    """
+    height_u, width_u = upper_shape[:2]
+    height_b, width_b = bottom_shape[:2]
+    pts1 = np.float32([[0, width_u],
+                       [height_u, 0],
+                       [height_u, width_u]])
+    matrices = []
+    for translate_factor in translate_factors:
+        pts2 = np.float32([[translate_factor, width_b],
+                           [translate_factor + height_b, 0],
+                           [translate_factor + height_b, width_b]])
+        matrices.append(cv2.getAffineTransform(pts1, pts2))
+    return matrices
+
+
+def translated_stack(upper, bottom, translate_factors, pool=None):
+    """
+    Merge the upper image fitted to the bottom's size and translated by each factor on top of the bottom image
+    :param upper:
+    :param bottom:
+    :param translate_factors: translations in pixels
+    :param pool: CanvasPool the stack is taken from, None allocates it
+    :return: (len(translate_factors), upper height + bottom height, min width, 3) merged images
+    """
+    height_u, width_u = upper.shape[:2]
+    height_b, width_b = bottom.shape[:2]
+    min_width = min(width_u, width_b)
+    shape = (len(translate_factors), height_u + height_b, min_width, 3)
+    merged_images = pool.get(shape) if pool is not None else np.empty(shape, np.uint8)
+    merged_images[:, height_u:] = bottom[:, 0:min_width]
+    matrices = translate_matrices(upper.shape, bottom.shape, translate_factors)
+    kind = classify_affine(matrices[0])
+    shifts = column_shifts(matrices) if kind != AFFINE else None
+
+    if shifts is not None:
+        # the sweep is a single transform shifted by whole columns: transform once into a canvas wide enough for
+        # every shift, each merged image then takes its columns window
+        reference = int(np.argmax(shifts))
+        margin = int(shifts[reference] - shifts.min())
+        wide_shape = (height_u, width_u + margin, 3)
+        wide = pool.get(wide_shape) if pool is not None else np.empty(wide_shape, np.uint8)
+        matrix = matrices[reference]
+        if kind != SCALE_TRANSLATION and np.allclose(matrix[:, 2], np.round(matrix[:, 2])):
+            shift_image(upper, int(round(matrix[0, 2])), int(round(matrix[1, 2])), width_u + margin, height_u, wide)
+        else:
+            cv2.warpAffine(upper, matrix, (width_u + margin, height_u), dst=wide)
+        for merged_image, shift in zip(merged_images, shifts):
+            start = int(shifts[reference] - shift)
+            merged_image[0:height_u] = wide[:, start:start + min_width]
+        return merged_images
+
+    # the warps write straight into the top of the merged images when no column has to be cut
+    warped = None
+    if min_width < width_u:
+        warped = pool.get(upper.shape) if pool is not None else np.empty(upper.shape, np.uint8)
+    for merged_image, matrix in zip(merged_images, matrices):
+        if warped is None:
+            cv2.warpAffine(upper, matrix, (width_u, height_u), dst=merged_image[0:height_u])
+        else:
+            cv2.warpAffine(upper, matrix, (width_u, height_u), dst=warped)
+            merged_image[0:height_u] = warped[:, 0:min_width]
+    return merged_images
@@ -6,8 +6,12 @@ import numpy as np
 
 import common
 from PartialSkeleton import create_affined_image, compare_images
+from Skeleton import Skeleton
+from batch_inference import inference_batch
+from inference_cache import cached_estimator
+from model_registry import get_pose_estimator
 from estimator import TfPoseEstimator
-from networks import get_graph_path, model_wh
+from networks import model_wh
 
 
 def calculate_rmse(merged_image_parts, second_image_parts):
@@ -17,21 +21,17 @@ def calculate_rmse(merged_image_parts, second_image_parts):
     :param second_image_parts:
     :return:
     """
-    xSource = []
-    ySource = []
-    xDest = []
-    yDest = []
-    for i in [8, 9, 10, 11, 12, 13]:
-        x1 = merged_image_parts[0].body_parts[i].x * h
-        xDest.append(x1)
-        x2 = second_image_parts[0].body_parts[i].x * h
-        xSource.append(x2)
-        y1 = merged_image_parts[0].body_parts[i].y * w
-        yDest.append(y1)
-        y2 = second_image_parts[0].body_parts[i].y * w
-        ySource.append(y2)
-    mseX = ((np.array(xSource) - np.array(xDest)) ** 2).mean()
-    mseY = ((np.array(ySource) - np.array(yDest)) ** 2).mean()
+    legs = [8, 9, 10, 11, 12, 13]
+    merged_skeleton = Skeleton.from_human(merged_image_parts[0])
+    second_skeleton = Skeleton.from_human(second_image_parts[0])
+    if not merged_skeleton.has_parts(legs) or not second_skeleton.has_parts(legs):
+        raise KeyError("Both skeletons must have all the legs parts")
+    xDest = merged_skeleton.x[legs].astype(np.float64) * h
+    xSource = second_skeleton.x[legs].astype(np.float64) * h
+    yDest = merged_skeleton.y[legs].astype(np.float64) * w
+    ySource = second_skeleton.y[legs].astype(np.float64) * w
+    mseX = ((xSource - xDest) ** 2).mean()
+    mseY = ((ySource - yDest) ** 2).mean()
     rmseX = np.sqrt(mseX)
     rmseY = np.sqrt(mseY)
     totalRMSE = np.sqrt(1 / xSource.__len__() * (mseX + mseX))
@@ -47,19 +47,19 @@ if __name__ == '__main__':
     parser.add_argument('--resolution', type=str, default='432x368', help='network input resolution. default=432x368')
     parser.add_argument('--model', type=str, default='mobilenet_thin', help='cmu / mobilenet_thin')
     parser.add_argument('--scales', type=str, default='[None]', help='for multiple scales, eg. [1.0, (1.1, 0.05)]')
+    parser.add_argument('--cache', type=str, default=None, help='persistent inference cache file')
     args = parser.parse_args()
     scales = ast.literal_eval(args.scales)
 
     w, h = model_wh(args.resolution)
-    estimator = TfPoseEstimator(get_graph_path(args.model), target_size=(w, h))
+    estimator = cached_estimator(get_pose_estimator(args.model, (w, h)), args.cache, args.model)
 
     # Load 2 images
     first_image = common.read_imgfile(args.image1, None, None)
     second_image = common.read_imgfile(args.image2, None, None)
 
     # Get each image skeleton
-    first_image_parts = estimator.inference(first_image, scales=scales)
-    second_image_parts = estimator.inference(second_image, scales=scales)
+    first_image_parts, second_image_parts = inference_batch(estimator, [first_image, second_image], scales=scales)
 
     # Display the two skeleton on images
     image = TfPoseEstimator.draw_humans(first_image, first_image_parts, imgcopy=True)
@@ -4,8 +4,9 @@ import imutils
 import numpy as np
 from imutils.object_detection import non_max_suppression
 
+import model_registry
 import video_utils
-from tensorflow_human_detection import DetectorAPI
+from model_registry import get_detector
 
 
 class ShapeDetector:
@@ -221,37 +222,64 @@ def find_extreme_points(image):
 
 
 def detect_using_tf(img):
-    model_path = 'faster_rcnn_inception_v2_coco_2018_01_28/frozen_inference_graph.pb'
-    odapi = DetectorAPI(path_to_ckpt=model_path)
+    # the detector graph is loaded once per process and shared by all the calls
+    odapi = get_detector()
     threshold = 0.7
 
-    boxes, scores, classes, num = odapi.processFrame(img)
+    # Class 1 represents human
+    boxes = odapi.processFrame(img, as_array=True, threshold=threshold, class_id=1)
 
     # Visualization of the results of a detection.
     pts2 = np.float32([])
-    for i in range(len(boxes)):
-        # Class 1 represents human
-        if classes[i] == 1 and scores[i] > threshold:
-            box = boxes[i]
-            cv2.rectangle(img, (box[1], box[0]), (box[3], box[2]), (255, 0, 0), 2)
-            pts2 = np.float32([[box[1], box[0]],
-                               [box[1], box[2]],
-                               [box[3], box[2]]])
+    for box in boxes.tolist():
+        cv2.rectangle(img, (box[1], box[0]), (box[3], box[2]), (255, 0, 0), 2)
+    if len(boxes) > 0:
+        box = boxes[-1]
+        pts2 = np.float32([[box[1], box[0]],
+                           [box[1], box[2]],
+                           [box[3], box[2]]])
 
     # cv2.imshow("preview", img)
     # cv2.waitKey()
     return pts2
 
 
+def detect_using_tf_multiscale(img, scale_factors, threshold=0.7):
+    """
+    Detect the human in all the scaled versions of an image with a single detector run.
+    The detector resizes its input to a fixed range anyway, so the image is detected once and the box is scaled by
+    each factor.
+    :param img:
+    :param scale_factors:
+    :param threshold: min detection score
+    :return: list of affine points per scale factor (same as detect_using_tf)
+    """
+    odapi = get_detector()
+    height, width, channels = img.shape
+    # Class 1 represents human, the last one found is used
+    boxes = odapi.processFrame(img, as_array=True, threshold=threshold, class_id=1)
+    if len(boxes) == 0:
+        return [np.float32([]) for _ in scale_factors]
+    top, left, bottom, right = boxes[-1]
+    points = []
+    for scale_factor in scale_factors:
+        # same ratios as the resize of the scaled image
+        scale_x = int(width * scale_factor) / float(width)
+        scale_y = int(height * scale_factor) / float(height)
+        points.append(np.float32([[int(left * scale_x), int(top * scale_y)],
+                                  [int(left * scale_x), int(bottom * scale_y)],
+                                  [int(right * scale_x), int(bottom * scale_y)]]))
+    return points
+
+
 if __name__ == '__main__':
     bottom_images = video_utils.load_images_from_folder("./images/bottom/",True)
     data = []
+    scale_factors = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
     for img in bottom_images:
-        for scale_factor in [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]:
-            height_b, width_b, channels = img[0].shape
-            scaled_bottom = cv2.resize(img[0], (int(width_b * scale_factor), int(height_b * scale_factor)), fx=scale_factor,
-                                       fy=scale_factor, interpolation=cv2.INTER_AREA)
-            pts = detect_using_tf(scaled_bottom)
+        # all the scales of an image come from a single detection
+        for scale_factor, pts in zip(scale_factors, detect_using_tf_multiscale(img[0], scale_factors)):
             data.append([img[1],scale_factor, pts])
     with open('human_points.pickle', 'wb') as handle:
-        pickle.dump(data, handle, protocol=pickle.HIGHEST_PROTOCOL)
\ No newline at end of file
+        pickle.dump(data, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    model_registry.report()
@@ -0,0 +1,255 @@
+import argparse
+
+import numpy as np
+
+from Skeleton import Skeleton
+from scoring import LEG_PARTS
+
+# thigh and shin of each leg
+LEG_SEGMENTS = [(8, 9), (9, 10), (11, 12), (12, 13)]
+FEATURE_NAMES = ('hip_width', 'hip_center', 'right_thigh', 'right_shin', 'left_thigh', 'left_shin', 'aspect')
+# hip width is a small fraction of the image, it is weighted up to count as much as an angle
+FEATURE_WEIGHTS = np.float32([16, 4, 1, 1, 1, 1, 1])
+# the hips are the only part an upper body image and a legs image both have
+HIP_FEATURE_NAMES = ('hip_width', 'hip_center', 'hip_tilt', 'hip_ratio')
+HIP_FEATURE_WEIGHTS = np.float32([16, 4, 4, 4])
+
+
+def pose_features(skeleton, image_size):
+    """
+    Size independent pose features of a skeleton's legs
+    :param skeleton: Skeleton
+    :param image_size: (height, width) of the image the skeleton was found on
+    :return: (7,) float32 array (see FEATURE_NAMES), NaN where the parts are missing
+    """
+    features = np.full(len(FEATURE_NAMES), np.nan, np.float32)
+    if skeleton is None:
+        return features
+    height, width = image_size[:2]
+    points = skeleton.points[:, :2] * np.float32([width, height])
+    mask = skeleton.mask
+    if mask[8] and mask[11]:
+        features[0] = abs(points[11, 0] - points[8, 0]) / width
+        features[1] = (points[11, 0] + points[8, 0]) / 2 / width
+    for i, (start, end) in enumerate(LEG_SEGMENTS):
+        if mask[start] and mask[end]:
+            # angle from the vertical, 0 for a straight leg
+            delta = points[end] - points[start]
+            features[2 + i] = np.arctan2(delta[0], delta[1])
+    legs = points[LEG_PARTS][mask[LEG_PARTS]]
+    if len(legs) >= 2:
+        extent = legs.max(axis=0) - legs.min(axis=0)
+        if extent[0] > 0 and extent[1] > 0:
+            features[6] = np.log(extent[1] / extent[0])
+    return features
+
+
+def hip_features(skeleton, image_size):
+    """
+    Size independent pose features of a skeleton's hips, found on upper body images and legs images alike.
+    The hip ratio is the hip width over the length of the body next to the hips: the torso (neck to hips center) when
+    the neck is found, else the mean thigh. Both are about as long, so an upper and a bottom image can be compared:
+    the ratio is the largest facing the camera and shrinks as the person turns sideways.
+    :param skeleton: Skeleton
+    :param image_size: (height, width) of the image the skeleton was found on
+    :return: (4,) float32 array (see HIP_FEATURE_NAMES), NaN where the parts are missing
+    """
+    features = np.full(len(HIP_FEATURE_NAMES), np.nan, np.float32)
+    if skeleton is None or not (skeleton.mask[8] and skeleton.mask[11]):
+        return features
+    height, width = image_size[:2]
+    points = skeleton.points[:, :2] * np.float32([width, height])
+    mask = skeleton.mask
+    delta = points[11] - points[8]
+    center = (points[8] + points[11]) / 2
+    features[0] = abs(delta[0]) / width
+    features[1] = center[0] / width
+    # angle of the hips line from the horizontal, 0 for level hips whichever way the person faces
+    features[2] = np.arctan2(delta[1], abs(delta[0]))
+    if mask[1]:
+        length = np.hypot(*(center - points[1]))
+    else:
+        thighs = [np.hypot(*(points[knee] - points[hip])) for hip, knee in ((8, 9), (11, 12)) if mask[knee]]
+        length = np.mean(thighs) if thighs else 0
+    if length > 0:
+        features[3] = np.hypot(*delta) / length
+    return features
+
+
+# features function, names and weights of each kind of donor index: 'legs' for full body donors compared by their
+# legs, 'hips' for upper body donors
+FEATURE_SETS = {'legs': (pose_features, FEATURE_NAMES, FEATURE_WEIGHTS),
+                'hips': (hip_features, HIP_FEATURE_NAMES, HIP_FEATURE_WEIGHTS)}
+
+
+def box_features(box, image_size, names=FEATURE_NAMES):
+    """
+    Pose features that can be guessed from a legs detection box
+    :param box: (top, left, bottom, right) in pixels
+    :param image_size: (height, width) of the image
+    :param names: feature names of the index
+    :return: float32 array, only hip center and aspect are set
+    """
+    features = np.full(len(names), np.nan, np.float32)
+    top, left, bottom, right = [float(value) for value in box]
+    if 'hip_center' in names:
+        features[names.index('hip_center')] = (left + right) / 2 / image_size[1]
+    if 'aspect' in names and right > left and bottom > top:
+        features[names.index('aspect')] = np.log((bottom - top) / (right - left))
+    return features
+
+
+class DonorIndex(object):
+    """
+    This class purpose is to pick the donor images whose pose fits a bottom image before any merge and inference.
+    The donors are kept as one (n, features) array, a query is a weighted distance over the features it has and
+    a partial sort of the n distances. The kind of the index tells the features: 'legs' for full body donors,
+    'hips' for upper body donors, which have no legs to compare (see FEATURE_SETS).
+    """
+
+    def __init__(self, paths, features, weights=None, kind='legs'):
+        """
+        Constructor
+        :param paths: donor image files
+        :param features: (n, features) pose features of the donors, NaN where unknown
+        :param weights: weight of each feature in the distance, None uses the kind's weights
+        :param kind: 'legs' or 'hips'
+        """
+        self.kind = kind
+        self.features_of, self.names, default_weights = FEATURE_SETS[kind]
+        self.paths = list(paths)
+        self._positions = dict((path, i) for i, path in enumerate(self.paths))
+        # subsets of the path filters already used by queries
+        self._subsets = {}
+        features = np.asarray(features, np.float32).reshape(len(self.paths), len(self.names))
+        # unknown donor features are neutral: set to the median of the donors that have them
+        medians = np.zeros(features.shape[1], np.float32)
+        for column in range(features.shape[1]):
+            known = features[~np.isnan(features[:, column]), column]
+            if len(known):
+                medians[column] = np.median(known)
+        self.raw_features = features
+        self.features = np.where(np.isnan(features), medians, features)
+        self.weights = np.asarray(default_weights if weights is None else weights, np.float32)
+        # weighted features stored column by column, a query only reads the columns it knows
+        self._scale = np.sqrt(self.weights)
+        self._columns = np.asfortranarray(self.features * self._scale)
+
+    @classmethod
+    def build(cls, estimator, donor_images, kind='legs'):
+        """
+        Infer the skeleton of every donor image and index its pose features
+        :param estimator: TfPoseEstimator
+        :param donor_images: list of [image, path]
+        :param kind: 'legs' for full body donors, 'hips' for upper body donors
+        :return: DonorIndex
+        """
+        features_of, names, _ = FEATURE_SETS[kind]
+        features = [features_of(Skeleton.best(estimator.inference(image, scales=None)), image.shape)
+                    for image, _ in donor_images]
+        return cls([path for _, path in donor_images], np.array(features).reshape(-1, len(names)), kind=kind)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            # indexes saved before the kinds were all legs indexes
+            kind = str(data['kind']) if 'kind' in data.files else 'legs'
+            return cls(data['paths'].tolist(), data['features'], data['weights'], kind)
+
+    def save(self, path):
+        np.savez(path, paths=np.array(self.paths), features=self.raw_features, weights=self.weights,
+                 kind=self.kind)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def subset(self, paths):
+        """
+        Index of some of the donors only, build it once and query it many times
+        :param paths: donor image files to keep, the ones not in the index are ignored
+        :return: DonorIndex, this index itself when the paths cover all of it
+        """
+        positions = np.array(sorted(set(self._positions[path] for path in paths if path in self._positions)),
+                             np.int64)
+        if len(positions) == len(self.paths):
+            return self
+        index = DonorIndex.__new__(DonorIndex)
+        index.kind = self.kind
+        index.features_of, index.names = self.features_of, self.names
+        index.paths = [self.paths[i] for i in positions]
+        index._positions = dict((path, i) for i, path in enumerate(index.paths))
+        index._subsets = {}
+        # the known features of the full index stay the reference for the unknown ones
+        index.raw_features = self.raw_features[positions]
+        index.features = self.features[positions]
+        index.weights = self.weights
+        index._scale = self._scale
+        index._columns = np.asfortranarray(self._columns[positions])
+        return index
+
+    def query(self, features, k=5, paths=None):
+        """
+        Find the donors closest to the given pose features
+        :param features: query features (see names), NaN features are ignored
+        :param k: number of donors
+        :param paths: only consider these donors, None considers all of them. The filtered index is kept per
+                      paths tuple, so repeated queries with the same filter do not rebuild it (see subset)
+        :return: list of (donor path, distance), closest first
+        """
+        if paths is not None:
+            paths = tuple(paths)
+            if paths not in self._subsets:
+                self._subsets[paths] = self.subset(paths)
+            index = self._subsets[paths]
+            if index is not self:
+                return index.query(features, k)
+        features = np.asarray(features, np.float32) * self._scale
+        columns = self._columns
+        if len(columns) == 0:
+            return []
+        distances = np.zeros(len(columns), np.float32)
+        for column in np.flatnonzero(~np.isnan(features)):
+            delta = columns[:, column] - features[column]
+            delta *= delta
+            distances += delta
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        top = top[np.argsort(distances[top], kind='stable')]
+        return [(self.paths[i], float(distances[i])) for i in top]
+
+    def query_skeleton(self, skeleton, image_size, k=5, paths=None):
+        """
+        :param skeleton: Skeleton of the bottom image
+        :param image_size: (height, width) of the bottom image
+        :param k:
+        :param paths:
+        :return: list of (donor path, distance), closest first
+        """
+        return self.query(self.features_of(skeleton, image_size), k, paths)
+
+    def query_box(self, box, image_size, k=5, paths=None):
+        """
+        :param box: (top, left, bottom, right) legs detection box of the bottom image
+        :param image_size: (height, width) of the bottom image
+        :param k:
+        :param paths:
+        :return: list of (donor path, distance), closest first
+        """
+        return self.query(box_features(box, image_size, self.names), k, paths)
+
+
+if __name__ == '__main__':
+    # this main indexes a folder of donor images
+    import video_utils
+    from model_registry import get_pose_estimator
+
+    parser = argparse.ArgumentParser(description='build the donor index')
+    parser.add_argument('--donors', type=str, default='./images/upper/', help='donor images folder')
+    parser.add_argument('--kind', type=str, default='hips', choices=sorted(FEATURE_SETS),
+                        help='hips for upper body donors (grid search), legs for full body donors (video)')
+    parser.add_argument('--out', type=str, default='./donor_index.npz', help='index file')
+    args = parser.parse_args()
+    donor_images = video_utils.load_images_from_folder(args.donors, True)
+    index = DonorIndex.build(get_pose_estimator('mobilenet_thin', (432, 368)), donor_images, args.kind)
+    index.save(args.out)
+    print("Indexed {} donors to {}".format(len(index), args.out))
@@ -1,9 +1,27 @@
+import argparse
+import functools
+import itertools
+import os
+import time
+
 import cv2
+import numpy as np
 
 import PartialSkeleton
 import video_utils
+from batch_inference import batched, inference_batch
+from composition import CanvasRing
+from donor_index import DonorIndex
+from inference_cache import cached_estimator
+from job_manifest import JobManifest
+from keypoint_smoother import KeypointSmoother
+from keypoint_tracker import KeypointTracker
+from model_registry import get_pose_estimator
+from pipeline import StagedPipeline
+from roi_cropper import RoiCropper
+from scoring import LEG_PARTS
+from Skeleton import Skeleton
 from estimator import TfPoseEstimator
-from networks import get_graph_path
 
 
 class CoordinateStore:
@@ -25,60 +43,330 @@ def generate_skeletonize_video():
     output_folder = "./videos"
     results_folder = "./images/demo/"
     input_video = "./videos/demo.mp4"
-    images = video_utils.load_images_from_folder(input_folder)
+    images = video_utils.iter_images(input_folder, sort=True)
     w = 432
     h = 368
-    estimator = TfPoseEstimator(get_graph_path('mobilenet_thin'), target_size=(w, h))
+    estimator = get_pose_estimator('mobilenet_thin', (w, h))
     count = 1
-    for i in images:
-        image_parts = estimator.inference(i, scales=None)
-        image_skeleton = TfPoseEstimator.draw_humans(i, image_parts, imgcopy=True)
-        cv2.imwrite(r".\images\demo\{}.png".format(count), image_skeleton)
-        count = count + 1
+    for batch in batched(images, 8):
+        for i, image_parts in zip(batch, inference_batch(estimator, batch, scales=None)):
+            image_skeleton = TfPoseEstimator.draw_humans(i, image_parts, imgcopy=True)
+            cv2.imwrite(r".\images\demo\{}.png".format(count), image_skeleton)
+            count = count + 1
     video_utils.create_video(input_video, results_folder, output_folder)
 
 
-if __name__ == '__main__':
-    input_folder = "./videos/walking/"
-    results_folder = "./images/results/"
-    input_video = "./videos/walking.mp4"
-    output_folder = "./videos"
-    print("Start splitting video")
-    video_utils.split_video(input_video, input_folder)
-    print("Video was splited")
-    print("Loading all images")
-    images = video_utils.load_images_from_folder(input_folder, False, True)
-    print("Loaded {} images from {} folder".format(images.__len__(), input_folder))
-    first_image = images[0]
-    # instantiate class
-    coordinateStore1 = CoordinateStore()
-
-    # Bind the function to window
-    img = images[0]
-    cv2.namedWindow('image')
-    cv2.setMouseCallback('image', coordinateStore1.select_point)
-
-    while 1:
-        cv2.imshow('image', first_image)
-        k = cv2.waitKey(20) & 0xFF
-        if k == 27:  # ESC
+def smoothed(infer, smoother):
+    """
+    Add temporal smoothing to an inference function of consecutive merged images
+    :param infer: function of merged images returning merged image and body parts pairs
+    :param smoother: KeypointSmoother
+    :return: inference function returning the smoothed body parts
+    """
+    def infer_smoothed(merged_images):
+        return [(merged_image, smoother.smooth(parts, merged_image.shape))
+                for merged_image, parts in infer(merged_images)]
+    return infer_smoothed
+
+
+def skeletonize_video_frames(estimator, input_video, hip, size=(432, 368), threaded=False, queue_size=4, batch_size=1,
+                             start=0, stop=None, roi_cropper=None, tracker=None, smoother=None,
+                             reference_image_path='./images/full_body1.png'):
+    """
+    Streaming version of the partial skeleton flow: frames are decoded and skeletonized one at a time (generator),
+    from a single open capture
+    :param estimator:
+    :param input_video:
+    :param hip:
+    :param size: (width, height) of the processed frames
+    :param threaded: run decode, preprocessing, inference and drawing on separate threads
+    :param queue_size: max batches waiting between two threaded stages
+    :param batch_size: number of frames inferred in a single network run
+    :param start: index of the first frame to process
+    :param stop: index of the frame to stop at, None processes to the end
+    :param roi_cropper: optional RoiCropper, pose is then inferred only around the detected person
+    :param tracker: optional KeypointTracker, pose is then inferred only on some frames and tracked on the others
+    :param smoother: optional KeypointSmoother, filters the keypoints over time before drawing
+    :param reference_image_path: full body donor image completing the upper part
+    :return: legs images, each one is valid until the next one is taken
+    """
+    w, h = size
+    skeletonizer = PartialSkeleton.get_skeletonizer(estimator, hip, reference_image_path, w, h, roi_cropper)
+    # the previous frame's box and skeleton are not reused across streams
+    if roi_cropper is not None:
+        roi_cropper.reset()
+    if tracker is None:
+        infer = skeletonizer.infer_batch
+    else:
+        tracker.reset()
+        infer = functools.partial(skeletonizer.infer_tracked, tracker=tracker)
+    if smoother is not None:
+        smoother.reset()
+        infer = smoothed(infer, smoother)
+    # the merged frames and their legs views are reused canvases: enough of them for every frame alive at once
+    if not threaded:
+        canvases = CanvasRing((2 * h, w, 3), batch_size + 1)
+        for batch in batched(video_utils.read_frames(input_video, size, start, stop), batch_size):
+            for merged in infer([skeletonizer.merge(frame, canvases.get()) for frame in batch]):
+                yield skeletonizer.draw_legs(merged, copy=False)
+        return
+
+    def preprocess(frames):
+        return [skeletonizer.merge(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), canvases.get())
+                for frame in frames]
+
+    def draw(merged):
+        return [skeletonizer.draw_legs(item, copy=False) for item in merged]
+
+    stages = [('preprocess', preprocess),
+              ('inference', infer),
+              ('draw', draw)]
+    # a full queue after each stage, a batch in each stage and one in the writer
+    canvases = CanvasRing((2 * h, w, 3), (queue_size * len(stages) + len(stages) + 1) * batch_size)
+    staged_pipeline = StagedPipeline(stages, queue_size=queue_size)
+    batches = batched(video_utils.read_frames(input_video, None, start, stop), batch_size)
+    for batch in staged_pipeline.run(batches):
+        for legs in batch:
+            yield legs
+    staged_pipeline.report()
+
+
+def skeletonize_video_stream(estimator, input_video, output_video, hip, size=(432, 368), **stream_args):
+    """
+    Skeletonize a video straight to the output video, memory stays constant and no intermediate images are written
+    :param estimator:
+    :param input_video:
+    :param output_video: output video file path
+    :param hip:
+    :param size: (width, height) of the processed frames
+    :param stream_args: skeletonize_video_frames options (threaded, queue_size, batch_size, start, stop,
+                        roi_cropper, tracker, smoother, reference_image_path)
+    :return: number of written frames
+    """
+    return video_utils.write_frames(skeletonize_video_frames(estimator, input_video, hip, size, **stream_args),
+                                    output_video, video_utils.get_fps(input_video))
+
+
+def skeletonize_video_job(estimator, input_video, output_video, hip, manifest, size=(432, 368), segment_frames=300,
+                          **stream_args):
+    """
+    Resumable version of skeletonize_video_stream: the output is written in segments of segment_frames frames and
+    every finished segment is recorded in the manifest, so a rerun only processes the unfinished segments.
+    A single stream runs from the first unfinished segment to the end of the video and is split into the segments,
+    so the capture is opened (and the finished frames skipped) once and the tracking state goes on across segments.
+    The segments are joined into the output video at the end (requires ffmpeg).
+    :param estimator:
+    :param input_video:
+    :param output_video: output video file path
+    :param hip:
+    :param manifest: JobManifest of this video job
+    :param size: (width, height) of the processed frames
+    :param segment_frames: number of frames per segment
+    :param stream_args: skeletonize_video_frames options (threaded, queue_size, batch_size, roi_cropper, tracker,
+                         smoother, reference_image_path)
+    :return: number of frames in the output video
+    """
+    segments_folder = os.path.splitext(output_video)[0] + '_segments'
+    if not os.path.exists(segments_folder):
+        os.makedirs(segments_folder)
+    done = manifest.completed_frames()
+    frames_total = manifest.metadata.get('frames_total')
+
+    def segment_file(segment):
+        return os.path.join(segments_folder, '{:05d}.mp4'.format(segment))
+
+    # the finished segments at the start of the video are kept
+    segment_files = []
+    segment = 0
+    while frames_total is None or segment * segment_frames < frames_total:
+        start = segment * segment_frames
+        stop = start + segment_frames if frames_total is None else min(start + segment_frames, frames_total)
+        if not os.path.exists(segment_file(segment)) or not all(i in done for i in range(start, stop)):
             break
-    cv2.destroyAllWindows()
+        segment_files.append(segment_file(segment))
+        segment += 1
+
+    start = segment * segment_frames
+    if frames_total is None or start < frames_total:
+        fps = video_utils.get_fps(input_video)
+        legs_frames = skeletonize_video_frames(estimator, input_video, hip, size, start=start, **stream_args)
+        try:
+            while True:
+                # write to a temporary file first so a half written segment is never taken as done
+                part_file = os.path.join(segments_folder, '{:05d}.part.mp4'.format(segment))
+                frames_count = video_utils.write_frames(itertools.islice(legs_frames, segment_frames), part_file,
+                                                        fps)
+                if frames_count > 0:
+                    os.replace(part_file, segment_file(segment))
+                    manifest.mark_frames(start, start + frames_count)
+                    segment_files.append(segment_file(segment))
+                    print("Segment #{} done ({} frames)".format(segment, frames_count))
+                if frames_count < segment_frames:
+                    # end of the video
+                    frames_total = start + frames_count
+                    manifest.set_metadata(frames_total=frames_total)
+                    break
+                start += segment_frames
+                segment += 1
+        finally:
+            legs_frames.close()
+
+    video_utils.concat_videos(segment_files, output_video)
+    return frames_total
+
+
+def choose_donor(estimator, donor_index, frame):
+    """
+    Pick the full body donor whose legs pose is the closest to the legs found on a frame
+    :param estimator:
+    :param donor_index: DonorIndex of full body images
+    :param frame:
+    :return: donor image path, None if the index is empty
+    """
+    skeleton = Skeleton.best(estimator.inference(frame, scales=None))
+    donors = donor_index.query_skeleton(skeleton, frame.shape, k=1)
+    return donors[0][0] if donors else None
+
+
+def compare_tracking(estimator, input_video, hip, tracker, size=(432, 368), stop=None):
+    """
+    Measure the tracking mode against full per frame inference on the same frames
+    :param estimator:
+    :param input_video:
+    :param hip:
+    :param tracker: KeypointTracker
+    :param size: (width, height) of the processed frames
+    :param stop: index of the frame to stop at, None processes the whole video
+    :return: dict of frames per second of both modes and the legs keypoints error in pixels
+    """
+    w, h = size
+    skeletonizer = PartialSkeleton.get_skeletonizer(estimator, hip, w=w, h=h)
+    merged_images = [skeletonizer.merge(frame) for frame in video_utils.read_frames(input_video, size, 0, stop)]
 
-    print("Selected Coordinates: ")
-    for i in coordinateStore1.points:
-        print(i)
+    start_time = time.time()
+    full = [skeletonizer.infer(merged_image)[1] for merged_image in merged_images]
+    full_time = time.time() - start_time
 
-    hip = coordinateStore1.points
+    tracker.reset()
+    start_time = time.time()
+    tracked = [parts for _, parts in skeletonizer.infer_tracked(merged_images, tracker)]
+    tracked_time = time.time() - start_time
 
+    # pixel distance between the legs keypoints found by both modes
+    errors = []
+    missed = 0
+    for full_parts, tracked_parts in zip(full, tracked):
+        full_skeleton = Skeleton.best(full_parts)
+        tracked_skeleton = Skeleton.best(tracked_parts)
+        if full_skeleton is None:
+            continue
+        parts = LEG_PARTS[full_skeleton.mask[LEG_PARTS]]
+        if tracked_skeleton is None:
+            missed += len(parts)
+            continue
+        missed += int((~tracked_skeleton.mask[parts]).sum())
+        parts = parts[tracked_skeleton.mask[parts]]
+        delta = (full_skeleton.points[parts, :2] - tracked_skeleton.points[parts, :2]) * np.float32([w, 2 * h])
+        errors.extend(np.sqrt((delta ** 2).sum(axis=1)).tolist())
+
+    result = {'frames': len(merged_images),
+              'full_fps': len(merged_images) / max(full_time, 1e-9),
+              'tracked_fps': len(merged_images) / max(tracked_time, 1e-9),
+              'mean_error': float(np.mean(errors)) if errors else 0.0,
+              'max_error': float(np.max(errors)) if errors else 0.0,
+              'missed_parts': missed}
+    print("{frames} frames: full inference {full_fps:.1f} fps, tracking {tracked_fps:.1f} fps, legs error mean "
+          "{mean_error:.1f}px max {max_error:.1f}px, {missed_parts} legs parts lost".format(**result))
+    tracker.report()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='partial skeleton video')
+    parser.add_argument('--cache', type=str, default=None, help='persistent inference cache file')
+    parser.add_argument('--resumable', action='store_true',
+                        help='write the output in segments so an interrupted run can be resumed (requires ffmpeg)')
+    parser.add_argument('--restart', action='store_true', help='drop the progress of a previous run')
+    parser.add_argument('--roi', type=int, default=0,
+                        help='crop each frame to the detected person before pose inference, '
+                             'the person detector runs every ROI frames (0 infers the whole frame)')
+    parser.add_argument('--track', type=int, default=0,
+                        help='run the pose network every TRACK frames and track the keypoints in between '
+                             '(0 infers every frame)')
+    parser.add_argument('--smooth', action='store_true', help='filter the keypoints over time to remove jitter')
+    parser.add_argument('--donor-index', type=str, default=None,
+                        help='legs donor index of full body images (see donor_index.py --kind legs), the donor '
+                             'closest to the first frame replaces ./images/full_body1.png')
+    parser.add_argument('--compare-tracking', action='store_true',
+                        help='measure the tracking mode against full per frame inference and exit')
+    args = parser.parse_args()
+    input_video = "./videos/walking.mp4"
+    output_video = "./videos/output.mp4"
     w = 432
     h = 368
-    estimator = TfPoseEstimator(get_graph_path('mobilenet_thin'), target_size=(w, h))
-    count = 0
-    for img in images:
-        PartialSkeleton.skeletonize(estimator, img, hip, count)
-        count += 1
+    manifest = JobManifest(os.path.splitext(output_video)[0] + '_manifest.jsonl')
+    frames_total = manifest.metadata.get('frames_total')
+    # only a segmented job that still has unfinished segments is resumed, with the hip points and donor of its
+    # first run; any other run starts over and picks them again
+    resuming = (not args.restart and not args.compare_tracking and
+                manifest.metadata.get('input_video') == input_video and 'hip' in manifest.metadata and
+                (args.resumable or len(manifest) > 0) and
+                (frames_total is None or len(manifest.completed_frames()) < frames_total))
+    if not resuming:
+        manifest.clear()
+    resumable = resuming or (args.resumable and not args.compare_tracking)
+    if resuming:
+        hip = manifest.metadata['hip']
+    else:
+        first_image = next(video_utils.read_frames(input_video, (w, h)))
+        # instantiate class
+        coordinateStore1 = CoordinateStore()
 
-    print("Creating output video...")
-    video_utils.create_video(input_video, results_folder, output_folder)
-    print("Video was created.")
+        # Bind the function to window
+        img = first_image
+        cv2.namedWindow('image')
+        cv2.setMouseCallback('image', coordinateStore1.select_point)
+
+        while 1:
+            cv2.imshow('image', first_image)
+            k = cv2.waitKey(20) & 0xFF
+            if k == 27:  # ESC
+                break
+        cv2.destroyAllWindows()
+
+        print("Selected Coordinates: ")
+        for i in coordinateStore1.points:
+            print(i)
+
+        hip = coordinateStore1.points
+        if resumable:
+            manifest.set_metadata(input_video=input_video, hip=hip)
+
+    estimator = cached_estimator(get_pose_estimator('mobilenet_thin', (w, h)), args.cache)
+    roi_cropper = RoiCropper(target_size=(w, h), redetect_every=args.roi) if args.roi > 0 else None
+    tracker = KeypointTracker(detect_every=args.track) if args.track > 0 else None
+    smoother = KeypointSmoother(fps=video_utils.get_fps(input_video)) if args.smooth else None
+    reference_image_path = './images/full_body1.png'
+    if resuming:
+        # a resumed job keeps the same donor
+        reference_image_path = manifest.metadata.get('reference_image_path', reference_image_path)
+    elif args.donor_index:
+        first_frame = next(video_utils.read_frames(input_video, (w, h)))
+        reference_image_path = choose_donor(estimator, DonorIndex.load(args.donor_index),
+                                            first_frame) or reference_image_path
+        print("Donor: {}".format(reference_image_path))
+    if resumable and not resuming:
+        manifest.set_metadata(reference_image_path=reference_image_path)
+    if args.compare_tracking:
+        compare_tracking(estimator, input_video, hip, tracker or KeypointTracker(), (w, h))
+    else:
+        print("Creating output video...")
+        stream_args = dict(threaded=True, batch_size=4, roi_cropper=roi_cropper, tracker=tracker, smoother=smoother,
+                           reference_image_path=reference_image_path)
+        # rerunning an interrupted resumable job continues where it stopped
+        if resumable:
+            frames_count = skeletonize_video_job(estimator, input_video, output_video, hip, manifest, (w, h),
+                                                 **stream_args)
+        else:
+            frames_count = skeletonize_video_stream(estimator, input_video, output_video, hip, (w, h), **stream_args)
+        print("Video was created with {} frames.".format(frames_count))
@@ -0,0 +1,228 @@
+import atexit
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import batch_inference
+from Skeleton import Skeleton, stack, unstack
+
+
+def image_key(*images):
+    """
+    Hash the content of the given images
+    :param images: numpy images
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for image in images:
+        digest.update(str(image.shape).encode('ascii'))
+        digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class LRUCache(object):
+    """
+    Mapping that keeps only the most recently used entries, safe to share between threads
+    """
+
+    def __init__(self, max_size=256):
+        """
+        Constructor
+        :param max_size: max number of entries
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+
+class PersistentInferenceCache(object):
+    """
+    SQLite store of inference results keyed by image content and model configuration.
+    The least recently used entries are evicted once max_entries is reached. A hit does not write to the file, the
+    last use times are kept in memory and written with the next insert, every flush_every hits or on close.
+    """
+
+    def __init__(self, path, max_entries=1000000, flush_every=256):
+        """
+        Constructor
+        :param path: sqlite file path
+        :param max_entries: max number of stored results
+        :param flush_every: number of hits whose last use times are written together
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS inference '
+                                 '(key TEXT PRIMARY KEY, count INTEGER, parts INTEGER, humans BLOB, last_used REAL)')
+        self._connection.commit()
+        # key -> last use time not written yet
+        self._used = {}
+        # rows in the file, counted once and then kept up to date by the inserts and evictions
+        self._size = self._connection.execute('SELECT COUNT(*) FROM inference').fetchone()[0]
+
+    def _write_used(self):
+        # must be called with the lock held, the caller commits
+        if self._used:
+            self._connection.executemany('UPDATE inference SET last_used = ? WHERE key = ?',
+                                         [(used, key) for key, used in self._used.items()])
+            self._used = {}
+
+    def flush(self):
+        """
+        Write the pending last use times
+        :return:
+        """
+        with self._lock:
+            if self._used:
+                self._write_used()
+                self._connection.commit()
+
+    def get(self, key):
+        """
+        :param key:
+        :return: list of Human or None if missing
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT count, parts, humans FROM inference WHERE key = ?',
+                                           (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used[key] = time.time()
+            if len(self._used) >= self.flush_every:
+                self._write_used()
+                self._connection.commit()
+        count, parts, humans = row
+        packed = np.frombuffer(humans, np.float32).reshape((count, parts, 3))
+        mask = ~np.isnan(packed[:, :, 2])
+        return [skeleton.to_human() for skeleton in unstack(np.nan_to_num(packed), mask)]
+
+    def put(self, key, humans):
+        """
+        :param key:
+        :param humans: list of Human
+        :return:
+        """
+        points, mask = stack(Skeleton.from_humans(humans))
+        # missing parts are stored as NaN so a single array holds the whole result
+        packed = np.where(mask[:, :, None], points, np.nan).astype(np.float32)
+        with self._lock:
+            self._write_used()
+            exists = self._connection.execute('SELECT 1 FROM inference WHERE key = ?', (key,)).fetchone()
+            self._connection.execute('INSERT OR REPLACE INTO inference VALUES (?, ?, ?, ?, ?)',
+                                     (key, packed.shape[0], packed.shape[1], packed.tobytes(), time.time()))
+            if exists is None:
+                self._size += 1
+            if self._size > self.max_entries:
+                # other processes may share the file, count again before evicting
+                self._size = self._connection.execute('SELECT COUNT(*) FROM inference').fetchone()[0]
+                if self._size > self.max_entries:
+                    self._connection.execute('DELETE FROM inference WHERE key IN '
+                                             '(SELECT key FROM inference ORDER BY last_used LIMIT ?)',
+                                             (self._size - self.max_entries,))
+                    self._size = self.max_entries
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM inference').fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def __repr__(self):
+        return "inference cache {}: hits={} misses={}".format(self.path, self.hits, self.misses)
+
+
+class CachedEstimator(object):
+    """
+    Wrap a pose estimator so inference results are read from / written to a persistent cache
+    """
+
+    def __init__(self, estimator, cache, model_name='mobilenet_thin'):
+        """
+        Constructor
+        :param estimator: TfPoseEstimator
+        :param cache: PersistentInferenceCache
+        :param model_name: part of the cache key, results of different models never mix
+        """
+        self.estimator = estimator
+        self.cache = cache
+        self.model_name = model_name
+
+    def __getattr__(self, name):
+        return getattr(self.estimator, name)
+
+    def _key(self, npimg, scales):
+        return '{}|{}|{}|{}'.format(self.model_name, getattr(self.estimator, 'target_size', None), scales,
+                                    image_key(npimg))
+
+    def inference(self, npimg, scales=None):
+        key = self._key(npimg, scales)
+        humans = self.cache.get(key)
+        if humans is None:
+            humans = self.estimator.inference(npimg, scales=scales)
+            self.cache.put(key, humans)
+        return humans
+
+    def inference_batch(self, images, scales=None):
+        keys = [self._key(image, scales) for image in images]
+        humans_list = [self.cache.get(key) for key in keys]
+        missing = [i for i, humans in enumerate(humans_list) if humans is None]
+        if missing:
+            inferred = batch_inference.inference_batch(self.estimator, [images[i] for i in missing], scales=scales)
+            for i, humans in zip(missing, inferred):
+                self.cache.put(keys[i], humans)
+                humans_list[i] = humans
+        return humans_list
+
+
+def cached_estimator(estimator, cache_path=None, model_name='mobilenet_thin', max_entries=1000000):
+    """
+    Wrap the estimator with a persistent cache when a cache path is given
+    :param estimator:
+    :param cache_path: sqlite file path, None disables the cache
+    :param model_name:
+    :param max_entries:
+    :return: estimator
+    """
+    if not cache_path:
+        return estimator
+    cache = PersistentInferenceCache(cache_path, max_entries)
+    # write the last use times of the final hits
+    atexit.register(cache.flush)
+    return CachedEstimator(estimator, cache, model_name)
@@ -0,0 +1,98 @@
+import json
+import os
+
+
+class JobManifest(object):
+    """
+    Append only record of a long job's progress (JSON lines).
+    Every record is flushed and fsynced, so after a crash or preemption rerunning the job only redoes the
+    unfinished work. A line cut by a crash is ignored.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: manifest file path
+        """
+        self.path = path
+        self.metadata = {}
+        self._cells = set()
+        self._frames = set()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'cells' in record:
+                    self._cells.update(tuple(cell) for cell in record['cells'])
+                elif 'frames' in record:
+                    self._frames.update(range(*record['frames']))
+                elif 'metadata' in record:
+                    self.metadata.update(record['metadata'])
+
+    def _append(self, record):
+        with open(self.path, 'a') as handle:
+            handle.write(json.dumps(record) + '\n')
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def set_metadata(self, **values):
+        """
+        Record job parameters that must stay the same when the job is resumed
+        :param values:
+        :return:
+        """
+        self.metadata.update(values)
+        self._append({'metadata': values})
+
+    def mark_cells(self, cells):
+        """
+        Record completed grid search cells
+        :param cells: list of (upper path, bottom path, scale, translate)
+        :return:
+        """
+        cells = [tuple(cell) for cell in cells]
+        self._cells.update(cells)
+        self._append({'cells': cells})
+
+    def is_cell_done(self, cell):
+        return tuple(cell) in self._cells
+
+    def completed_cells(self):
+        return set(self._cells)
+
+    def mark_frames(self, start, stop):
+        """
+        Record completed frames
+        :param start: first frame index
+        :param stop: one after the last frame index
+        :return:
+        """
+        self._frames.update(range(start, stop))
+        self._append({'frames': [start, stop]})
+
+    def completed_frames(self):
+        return set(self._frames)
+
+    def clear(self):
+        """
+        Forget all progress
+        :return:
+        """
+        self.metadata = {}
+        self._cells = set()
+        self._frames = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return len(self._cells) + len(self._frames)
@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+
+from Skeleton import PARTS_COUNT, Skeleton
+
+
+class KeypointSmoother(object):
+    """
+    This class purpose is to remove the frame to frame jitter of the video skeleton.
+    Each joint goes through a One-Euro filter (a low pass filter whose cutoff grows with the joint's speed, so slow
+    joints are steadied and fast ones are not delayed). The state is a fixed set of arrays over the 18 joints.
+    A joint missing for up to max_gap frames is extrapolated with its last velocity instead of disappearing.
+    """
+
+    def __init__(self, fps=30.0, min_cutoff=1.0, beta=0.01, d_cutoff=1.0, max_gap=3, gap_score_decay=0.8):
+        """
+        Constructor
+        :param fps: frames per second of the video
+        :param min_cutoff: cutoff frequency (Hz) of a still joint, lower is smoother
+        :param beta: cutoff increase per pixel per second of joint speed, higher follows fast motion better
+        :param d_cutoff: cutoff frequency (Hz) of the speed estimate
+        :param max_gap: max number of consecutive frames a missing joint is filled in
+        :param gap_score_decay: score multiplier of a filled in joint per missing frame
+        """
+        self.dt = 1.0 / fps
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.max_gap = max_gap
+        self.gap_score_decay = gap_score_decay
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the previous frames (call between videos)
+        :return:
+        """
+        self._position = np.zeros((PARTS_COUNT, 2), np.float64)
+        self._velocity = np.zeros((PARTS_COUNT, 2), np.float64)
+        self._score = np.zeros(PARTS_COUNT, np.float64)
+        self._active = np.zeros(PARTS_COUNT, np.bool_)
+        self._gap = np.zeros(PARTS_COUNT, np.int64)
+
+    def _alpha(self, cutoff):
+        """
+        :param cutoff: cutoff frequency, a number or an array
+        :return: exponential smoothing factor of a frame
+        """
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / self.dt)
+
+    def smooth(self, humans, image_shape):
+        """
+        Filter the next frame's skeleton
+        :param humans: humans found on the frame, the one with the highest score is smoothed
+        :param image_shape: shape of the frame, the filter works in pixels
+        :return: list with the smoothed Human, empty when no joint is left
+        """
+        image_h, image_w = image_shape[:2]
+        size = np.array([image_w, image_h], np.float64)
+        skeleton = Skeleton.best(humans) or Skeleton()
+        observed = skeleton.mask
+        position = skeleton.points[:, :2].astype(np.float64) * size
+
+        # joints seen for the first time (or after a long gap) start from their observed position
+        started = observed & ~self._active
+        self._position[started] = position[started]
+        self._velocity[started] = 0
+        self._score[started] = skeleton.score[started]
+
+        # One-Euro update of the joints seen on the previous frames
+        updated = observed & self._active
+        velocity = (position[updated] - self._position[updated]) / self.dt
+        velocity = self._velocity[updated] + self._alpha(self.d_cutoff) * (velocity - self._velocity[updated])
+        cutoff = self.min_cutoff + self.beta * np.sqrt((velocity ** 2).sum(axis=1, keepdims=True))
+        self._position[updated] += self._alpha(cutoff) * (position[updated] - self._position[updated])
+        self._velocity[updated] = velocity
+        self._score[updated] = skeleton.score[updated]
+
+        # short dropouts are filled in with the last velocity, longer ones end the joint
+        missing = ~observed & self._active
+        self._gap[observed] = 0
+        self._gap[missing] += 1
+        expired = missing & (self._gap > self.max_gap)
+        filled = missing & ~expired
+        self._position[filled] += self._velocity[filled] * self.dt
+        self._score[filled] *= self.gap_score_decay
+        self._active = (self._active | observed) & ~expired
+        self._gap[expired] = 0
+
+        if not self._active.any():
+            return []
+        points = np.zeros((PARTS_COUNT, 3), np.float32)
+        points[:, :2] = self._position / size
+        points[:, 2] = self._score
+        return [Skeleton(points, self._active.copy()).to_human()]
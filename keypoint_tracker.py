@@ -0,0 +1,133 @@
+import cv2
+import numpy as np
+
+from Skeleton import Skeleton
+
+
+class KeypointTracker(object):
+    """
+    This class purpose is to avoid running the pose network on every frame of a video.
+    The network runs every detect_every frames, or sooner when the frame changes too much; in between the keypoints
+    of the last skeleton are moved with sparse optical flow. A forward-backward flow check detects drift, and when
+    too many keypoints are lost the network is run again on that frame.
+    """
+
+    def __init__(self, detect_every=5, motion_threshold=12.0, max_error=2.0, min_tracked=0.75, win_size=(21, 21),
+                 max_level=3):
+        """
+        Constructor
+        :param detect_every: run the pose network at least every N frames
+        :param motion_threshold: mean gray level difference from the last detected frame that forces a detection
+        :param max_error: max forward-backward flow error in pixels for a keypoint to be kept
+        :param min_tracked: min fraction of keypoints that must be kept, a detection is run below it
+        :param win_size: Lucas-Kanade search window
+        :param max_level: Lucas-Kanade pyramid levels
+        """
+        self.detect_every = detect_every
+        self.motion_threshold = motion_threshold
+        self.max_error = max_error
+        self.min_tracked = min_tracked
+        self.lk_params = dict(winSize=win_size, maxLevel=max_level,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.detections = 0
+        self.tracked = 0
+        self.redetections = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the last skeleton (call between videos)
+        :return:
+        """
+        self._gray = None
+        self._key_gray = None
+        self._skeleton = None
+        self._since_detection = 0
+
+    @staticmethod
+    def _to_gray(image):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    def _motion(self, gray):
+        """
+        :param gray:
+        :return: mean absolute difference from the last detected frame, on a small copy
+        """
+        small = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA)
+        key_small = cv2.resize(self._key_gray, (64, 64), interpolation=cv2.INTER_AREA)
+        return float(np.abs(small.astype(np.int16) - key_small.astype(np.int16)).mean())
+
+    def needs_detection(self, gray):
+        """
+        :param gray:
+        :return: True if the pose network must run on this frame
+        """
+        return (self._skeleton is None or self._since_detection >= self.detect_every - 1 or
+                self._motion(gray) > self.motion_threshold)
+
+    def update(self, image, humans):
+        """
+        Start tracking from a frame the pose network ran on
+        :param image:
+        :param humans: humans found on the image
+        :return:
+        """
+        gray = self._to_gray(image)
+        self._gray = gray
+        self._key_gray = gray
+        self._skeleton = Skeleton.best(humans)
+        self._since_detection = 0
+        self.detections += 1
+
+    def track(self, image):
+        """
+        Move the last skeleton's keypoints to the given frame
+        :param image:
+        :return: list with the tracked Human, None when the keypoints drifted
+        """
+        gray = self._to_gray(image)
+        skeleton = self._skeleton.copy()
+        parts = np.flatnonzero(skeleton.mask)
+        if len(parts) == 0:
+            return None
+        image_h, image_w = gray.shape[:2]
+        points = (skeleton.points[parts, :2] * np.float32([image_w, image_h])).reshape(-1, 1, 2)
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, points, None, **self.lk_params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._gray, moved, None, **self.lk_params)
+        error = np.sqrt(((points - back) ** 2).sum(axis=2)).ravel()
+        kept = (status.ravel() == 1) & (back_status.ravel() == 1) & (error <= self.max_error)
+        if kept.mean() < self.min_tracked:
+            return None
+
+        skeleton.points[parts, :2] = moved.reshape(-1, 2) / np.float32([image_w, image_h])
+        skeleton.mask[parts[~kept]] = False
+        self._skeleton = skeleton
+        self._gray = gray
+        self._since_detection += 1
+        self.tracked += 1
+        return [skeleton.to_human()]
+
+    def process(self, image, detect):
+        """
+        Get the humans of the next frame, by tracking or by running the pose network
+        :param image:
+        :param detect: function that runs the pose network on an image and returns its humans
+        :return: humans
+        """
+        if not self.needs_detection(self._to_gray(image)):
+            humans = self.track(image)
+            if humans is not None:
+                return humans
+            self.redetections += 1
+        humans = detect(image)
+        self.update(image, humans)
+        return humans
+
+    def report(self):
+        """
+        Print how many frames were inferred and tracked
+        :return:
+        """
+        print("tracker: detections={} tracked={} drift redetections={}".format(self.detections, self.tracked,
+                                                                             self.redetections))
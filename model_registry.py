@@ -0,0 +1,114 @@
+import threading
+import time
+
+DETECTOR_MODEL_PATH = 'faster_rcnn_inception_v2_coco_2018_01_28/frozen_inference_graph.pb'
+
+_lock = threading.Lock()
+_models = {}
+_lazy_models = {}
+# seconds spent loading each model, by registry key
+load_times = {}
+
+
+def get_model(key, loader):
+    """
+    Get a process wide model, loading it on first use
+    :param key: registry key
+    :param loader: function creating the model
+    :return: model
+    """
+    with _lock:
+        if key not in _models:
+            start_time = time.time()
+            _models[key] = loader()
+            load_times[key] = time.time() - start_time
+            print("Loaded {} in {:.2f}s".format(key, load_times[key]))
+        return _models[key]
+
+
+def any_loaded():
+    """
+    :return: True if a model was loaded in this process, a forked child process would then share its TF session
+    """
+    with _lock:
+        return len(_models) > 0
+
+
+class LazyModel(object):
+    """
+    Placeholder that loads the registry model only when it is actually used.
+    Attributes given to the constructor are served without loading the model.
+    """
+
+    def __init__(self, key, loader, **known_attributes):
+        """
+        Constructor
+        :param key: registry key
+        :param loader: function creating the model
+        :param known_attributes: attributes available before loading (e.g. target_size)
+        """
+        self.__dict__.update(known_attributes)
+        self._key = key
+        self._loader = loader
+
+    @property
+    def model(self):
+        return get_model(self._key, self._loader)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_key', '_loader'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+def _get_lazy_model(key, loader, **known_attributes):
+    # the same placeholder is returned for the same key, so callers can rely on the estimator identity
+    with _lock:
+        if key not in _lazy_models:
+            _lazy_models[key] = LazyModel(key, loader, **known_attributes)
+        return _lazy_models[key]
+
+
+def get_pose_estimator(model='mobilenet_thin', target_size=(432, 368), lazy=True):
+    """
+    Get the process wide pose estimator of the given model and network size
+    :param model: cmu / mobilenet_thin
+    :param target_size: (width, height)
+    :param lazy: load the graph on first inference instead of now
+    :return: TfPoseEstimator (or a LazyModel of it)
+    """
+    def loader():
+        from estimator import TfPoseEstimator
+        from networks import get_graph_path
+        return TfPoseEstimator(get_graph_path(model), target_size=target_size)
+
+    key = ('pose', model, tuple(target_size))
+    if lazy:
+        return _get_lazy_model(key, loader, target_size=tuple(target_size))
+    return get_model(key, loader)
+
+
+def get_detector(path=DETECTOR_MODEL_PATH, lazy=True):
+    """
+    Get the process wide human detector of the given frozen graph
+    :param path: frozen inference graph path
+    :param lazy: load the graph on first detection instead of now
+    :return: DetectorAPI (or a LazyModel of it)
+    """
+    def loader():
+        from tensorflow_human_detection import DetectorAPI
+        return DetectorAPI(path_to_ckpt=path)
+
+    key = ('detector', path)
+    if lazy:
+        return _get_lazy_model(key, loader, path_to_ckpt=path)
+    return get_model(key, loader)
+
+
+def report():
+    """
+    Print the load time of every loaded model
+    :return:
+    """
+    for key, seconds in load_times.items():
+        print("{}: loaded in {:.2f}s".format(key, seconds))
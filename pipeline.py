@@ -0,0 +1,142 @@
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_END = object()
+
+
+class StageMetrics(object):
+    """
+    This class purpose is to gather the queue depth and timing info of a single pipeline stage
+    """
+
+    def __init__(self, name):
+        """
+        Constructor
+        """
+        self.name = name
+        self.items = 0
+        self.busy_time = 0.0
+        self.max_depth = 0
+        self._depth_sum = 0
+
+    def record(self, depth, elapsed):
+        """
+        Record a processed item
+        :param depth: input queue depth when the item was taken
+        :param elapsed: seconds spent in the stage function
+        :return:
+        """
+        self.items += 1
+        self.busy_time += elapsed
+        self._depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    @property
+    def mean_depth(self):
+        return self._depth_sum / float(self.items) if self.items else 0.0
+
+    def __repr__(self):
+        return "{}: items={} busy={:.2f}s queue depth mean={:.2f} max={}".format(
+            self.name, self.items, self.busy_time, self.mean_depth, self.max_depth)
+
+
+class _StageError(object):
+    def __init__(self, error):
+        self.error = error
+
+
+class StagedPipeline(object):
+    """
+    Run a chain of functions, each one on its own thread, connected by bounded queues.
+    One thread per stage keeps the items in their original order.
+    """
+
+    def __init__(self, stages, queue_size=4):
+        """
+        Constructor
+        :param stages: list of (name, function) pairs, each function gets the previous stage's output
+        :param queue_size: max items waiting between two stages
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.metrics = [StageMetrics(name) for name, _ in stages]
+        self._stop = threading.Event()
+
+    def _put(self, out_queue, item):
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _feed(self, source, out_queue):
+        try:
+            for item in source:
+                if self._stop.is_set():
+                    return
+                self._put(out_queue, item)
+        except Exception as e:
+            self._put(out_queue, _StageError(e))
+            return
+        self._put(out_queue, _END)
+
+    def _work(self, function, metrics, in_queue, out_queue):
+        while not self._stop.is_set():
+            try:
+                item = in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END or isinstance(item, _StageError):
+                self._put(out_queue, item)
+                return
+            depth = in_queue.qsize()
+            start_time = time.time()
+            try:
+                result = function(item)
+            except Exception as e:
+                self._put(out_queue, _StageError(e))
+                return
+            metrics.record(depth, time.time() - start_time)
+            self._put(out_queue, result)
+
+    def run(self, source):
+        """
+        Push the source items through all the stages
+        :param source: iterable of input items (consumed on its own thread)
+        :return: generator of the last stage's outputs, in source order
+        """
+        self._stop.clear()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0]))]
+        for i, (_, function) in enumerate(self.stages):
+            threads.append(threading.Thread(target=self._work,
+                                            args=(function, self.metrics[i], queues[i], queues[i + 1])))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _END:
+                    break
+                if isinstance(item, _StageError):
+                    raise item.error
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def report(self):
+        """
+        Print the per stage metrics
+        :return:
+        """
+        for metrics in self.metrics:
+            print(metrics)
@@ -0,0 +1,222 @@
+import argparse
+import csv
+import glob
+import os
+
+import numpy as np
+
+from OptimalParams import OptimalParams
+from Skeleton import PARTS_COUNT, Skeleton, stack
+from scoring import score_candidates
+
+FIELDS = ['upper', 'bottom', 'search', 'scale', 'translate', 'h', 'w', 'rmse', 'score', 'has_skeleton']
+# the fields before the numeric ones
+TEXT_FIELDS = 3
+SKELETON_FIELDS = ['{}_{}_{}'.format(prefix, part, value) for prefix in ('first', 'second')
+                   for part in range(PARTS_COUNT) for value in ('x', 'y', 'score')]
+
+
+def _skeleton_values(skeleton):
+    # missing parts are written as NaN
+    return np.where(skeleton.mask[:, None], skeleton.points, np.nan).ravel().tolist()
+
+
+class ResultStore(object):
+    """
+    Append only store of grid search results.
+    Each process appends rows to its own CSV shard in the store folder, rows are flushed as soon as a cell is done
+    so a crash only loses the cell in progress.
+    """
+
+    def __init__(self, folder):
+        """
+        Constructor
+        :param folder: store folder, created if needed
+        """
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self._file = None
+        self._writer = None
+
+    @property
+    def shard_path(self):
+        return os.path.join(self.folder, 'shard-{}.csv'.format(os.getpid()))
+
+    def append(self, params_list, search='grid'):
+        """
+        Write results to this process's shard
+        :param params_list: list of OptimalParams
+        :param search: search mode that found the results, 'grid' or 'coarse'
+        :return:
+        """
+        if self._file is None:
+            is_new = not os.path.exists(self.shard_path)
+            self._file = open(self.shard_path, 'a', newline='')
+            self._writer = csv.writer(self._file)
+            if is_new:
+                self._writer.writerow(FIELDS + SKELETON_FIELDS)
+        for params in params_list:
+            self._writer.writerow([params.upper[1], params.bottom[1], search, params.scale, params.translate, params.h,
+                                   params.w, params.rmse, params.score, int(bool(params.has_skeleton))] +
+                                  _skeleton_values(params.first_skeleton) + _skeleton_values(params.second_skeleton))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        """
+        Delete all the stored results
+        :return:
+        """
+        self.close()
+        for shard in glob.glob(os.path.join(self.folder, 'shard-*.csv')):
+            os.remove(shard)
+
+    def load(self, search=None):
+        """
+        Read all the shards as columns
+        :param search: only read the results of this search mode, None reads them all
+        :return: dict of column name to numpy array, skeletons as (n, 18, 3) points and (n, 18) masks
+        """
+        rows = []
+        for shard in sorted(glob.glob(os.path.join(self.folder, 'shard-*.csv'))):
+            with open(shard, newline='') as handle:
+                reader = csv.reader(handle)
+                header = next(reader, None)
+                # shards written before the search column have an unknown search mode
+                legacy = header is not None and 'search' not in header
+                for row in reader:
+                    if legacy:
+                        row.insert(2, '')
+                    # a row cut by a crash is shorter than the header and is dropped
+                    if len(row) == len(FIELDS) + len(SKELETON_FIELDS) and (search is None or row[2] == search):
+                        rows.append(row)
+        columns = {'upper': np.array([row[0] for row in rows]),
+                   'bottom': np.array([row[1] for row in rows]),
+                   'search': np.array([row[2] for row in rows])}
+        values = np.array([row[TEXT_FIELDS:] for row in rows], np.float64).reshape(
+            (len(rows), len(FIELDS) - TEXT_FIELDS + len(SKELETON_FIELDS)))
+        for i, name in enumerate(FIELDS[TEXT_FIELDS:]):
+            columns[name] = values[:, i]
+        columns['translate'] = columns['translate'].astype(np.int64)
+        columns['h'] = columns['h'].astype(np.int64)
+        columns['w'] = columns['w'].astype(np.int64)
+        columns['has_skeleton'] = columns['has_skeleton'].astype(np.bool_)
+        skeletons = values[:, len(FIELDS) - TEXT_FIELDS:].reshape((len(rows), 2, PARTS_COUNT, 3))
+        for i, prefix in enumerate(('first', 'second')):
+            columns[prefix + '_mask'] = ~np.isnan(skeletons[:, i, :, 2])
+            columns[prefix + '_points'] = np.nan_to_num(skeletons[:, i]).astype(np.float32)
+        return columns
+
+    def load_params(self, search=None, cells=None):
+        """
+        Read all the shards as OptimalParams
+        :param search: only read the results of this search mode, None reads them all
+        :param cells: only read the results of these cells (see completed_cells), None reads them all
+        :return: list of OptimalParams
+        """
+        columns = self.load(search)
+        params_list = []
+        for i in range(len(columns['upper'])):
+            if cells is not None and self._cell(columns, i) not in cells:
+                continue
+            params_list.append(OptimalParams.restore(
+                Skeleton(columns['first_points'][i], columns['first_mask'][i]),
+                Skeleton(columns['second_points'][i], columns['second_mask'][i]),
+                int(columns['translate'][i]), float(columns['scale'][i]), columns['upper'][i],
+                columns['bottom'][i], int(columns['h'][i]), int(columns['w'][i]), float(columns['rmse'][i]),
+                float(columns['score'][i]), bool(columns['has_skeleton'][i])))
+        return params_list
+
+    @staticmethod
+    def _cell(columns, i):
+        # a coarse search pair is a single cell without scale
+        scale = None if columns['search'][i] == 'coarse' else float(columns['scale'][i])
+        return columns['upper'][i], columns['bottom'][i], scale
+
+    def completed_cells(self, search, translate_factors=None):
+        """
+        :param search: search mode of the cells, 'grid' or 'coarse'
+        :param translate_factors: translations a grid cell must have to be complete (not used by the coarse search)
+        :return: set of (upper path, bottom path, scale) grid cells with all their translations stored, or of
+                 (upper path, bottom path, None) coarse search pairs with stored results
+        """
+        columns = self.load(search)
+        translates = {}
+        for i in range(len(columns['upper'])):
+            translates.setdefault(self._cell(columns, i), set()).add(int(columns['translate'][i]))
+        if search == 'coarse':
+            # the results of a coarse pair are written together once it is done
+            return set(translates)
+        return set(cell for cell, done in translates.items() if done.issuperset(translate_factors))
+
+
+def params_columns(params_list):
+    """
+    Convert in memory results to the same columns ResultStore.load() returns
+    :param params_list: list of OptimalParams
+    :return: dict of column name to numpy array
+    """
+    columns = {'upper': np.array([params.upper[1] for params in params_list]),
+               'bottom': np.array([params.bottom[1] for params in params_list]),
+               'scale': np.array([params.scale for params in params_list], np.float64),
+               'translate': np.array([params.translate for params in params_list], np.int64),
+               'h': np.array([params.h for params in params_list], np.int64),
+               'w': np.array([params.w for params in params_list], np.int64),
+               'rmse': np.array([params.rmse for params in params_list], np.float64),
+               'score': np.array([params.score for params in params_list], np.float64),
+               'has_skeleton': np.array([params.has_skeleton for params in params_list], np.bool_)}
+    columns['first_points'], columns['first_mask'] = stack([params.first_skeleton for params in params_list])
+    columns['second_points'], columns['second_mask'] = stack([params.second_skeleton for params in params_list])
+    return columns
+
+
+def score_columns(columns, lam=0.3):
+    """
+    Score stored results
+    :param columns: ResultStore.load() or params_columns() output
+    :param lam: confidence weight of the skeleton score
+    :return: rmses, scores, confidences
+    """
+    sizes = np.stack([columns['h'], columns['w']], axis=1)
+    return score_candidates(columns['first_points'], columns['second_points'], columns['first_mask'],
+                            columns['second_mask'], sizes, lam)
+
+
+def export_excel(columns, xlsx_path, lam=0.3):
+    """
+    Export stored results to an Excel file (requires pandas)
+    :param columns: ResultStore.load() output
+    :param xlsx_path:
+    :param lam: confidence weight of the skeleton score
+    :return:
+    """
+    import pandas as pd
+    from pandas import DataFrame, Series
+
+    rmses, scores, confidences = score_columns(columns, lam)
+    upper_names = [os.path.basename(path) for path in columns['upper']]
+    bottom_names = [os.path.basename(path) for path in columns['bottom']]
+    with pd.ExcelWriter(xlsx_path) as writer:
+        df = DataFrame(
+            {'Bottom Sample ID': Series(bottom_names), 'Upper Sample ID': Series(upper_names),
+             'Scale': Series(columns['scale']), 'Translations': Series(columns['translate']), 'RMSE': Series(rmses),
+             'Sum Of OpenPose Skeleton Joints': Series(scores), 'Dvir\'s Confidence Score': Series(confidences)})
+        df.to_excel(writer, sheet_name='partial-open-pose', index=False)
+        df = DataFrame({'Bottom': Series(list(set(bottom_names))), 'Upper': Series(list(set(upper_names)))})
+        df.to_excel(writer, sheet_name='Images', index=False)
+
+
+if __name__ == '__main__':
+    # this main exports a result store to Excel
+    parser = argparse.ArgumentParser(description='export grid search results')
+    parser.add_argument('--results', type=str, default='./results', help='result store folder')
+    parser.add_argument('--excel', type=str, default='results.xlsx')
+    parser.add_argument('--lam', type=float, default=0.3)
+    args = parser.parse_args()
+    export_excel(ResultStore(args.results).load(), args.excel, args.lam)
@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+
+
+class RoiCropper(object):
+    """
+    This class purpose is to run pose estimation only on the region of the person instead of the whole image.
+    The person box is found with the human detector (or reused from the previous frame), the image is cropped to it,
+    padded to the network's aspect ratio and the keypoints found on the crop are mapped back to image coordinates.
+    Small subjects fill the network input after cropping, so their keypoints are found more accurately.
+    """
+
+    def __init__(self, detector=None, target_size=(432, 368), margin=0.15, threshold=0.7, redetect_every=1,
+                 min_size=32):
+        """
+        Constructor
+        :param detector: DetectorAPI, None uses the process wide detector
+        :param target_size: (width, height) of the pose network, the crops are padded to its aspect ratio
+        :param margin: extra space around the person box, relative to the box size
+        :param threshold: min human detection score
+        :param redetect_every: run the detector every N calls, the previous box is reused in between
+        :param min_size: min crop side in pixels
+        """
+        if detector is None:
+            from model_registry import get_detector
+            detector = get_detector()
+        self.detector = detector
+        self.target_size = target_size
+        self.margin = margin
+        self.threshold = threshold
+        self.redetect_every = redetect_every
+        self.min_size = min_size
+        self.box = None
+        self._calls = 0
+
+    def reset(self):
+        """
+        Forget the previous frame's box (call between videos)
+        :return:
+        """
+        self.box = None
+        self._calls = 0
+
+    def detect(self, image):
+        """
+        Find the person box, reusing the previous one when no detection is due or no human is found
+        :param image:
+        :return: (top, left, bottom, right) int array or None
+        """
+        if self.box is None or self._calls % self.redetect_every == 0:
+            # Class 1 represents human
+            boxes = self.detector.processFrame(image, as_array=True, threshold=self.threshold, class_id=1)
+            if len(boxes) > 0:
+                areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+                self.box = boxes[np.argmax(areas)]
+        self._calls += 1
+        return self.box
+
+    def window(self, box, image_shape):
+        """
+        Add the margin to a box, grow it to the network's aspect ratio and clip it to the image
+        :param box: (top, left, bottom, right)
+        :param image_shape:
+        :return: (top, left, bottom, right) window
+        """
+        image_h, image_w = image_shape[:2]
+        top, left, bottom, right = [float(value) for value in box]
+        box_h = max(bottom - top, self.min_size) * (1 + 2 * self.margin)
+        box_w = max(right - left, self.min_size) * (1 + 2 * self.margin)
+
+        # grow the short side so resizing the crop to the network size keeps the proportions
+        aspect = float(self.target_size[0]) / self.target_size[1]
+        if box_w / box_h < aspect:
+            box_w = box_h * aspect
+        else:
+            box_h = box_w / aspect
+        center_y, center_x = (top + bottom) / 2, (left + right) / 2
+        return (max(int(center_y - box_h / 2), 0), max(int(center_x - box_w / 2), 0),
+                min(int(np.ceil(center_y + box_h / 2)), image_h), min(int(np.ceil(center_x + box_w / 2)), image_w))
+
+    def crop(self, image, window):
+        """
+        Crop the window, the parts clipped by the image borders are padded so the crop keeps the window's aspect ratio
+        :param image:
+        :param window: (top, left, bottom, right)
+        :return: crop, (crop top, crop left) offset of the crop in the image
+        """
+        top, left, bottom, right = window
+        crop = image[top:bottom, left:right]
+        crop_h, crop_w = crop.shape[:2]
+        aspect = float(self.target_size[0]) / self.target_size[1]
+        pad_h = max(int(round(crop_w / aspect)) - crop_h, 0)
+        pad_w = max(int(round(crop_h * aspect)) - crop_w, 0)
+        if pad_h or pad_w:
+            crop = cv2.copyMakeBorder(crop, 0, pad_h, 0, pad_w, cv2.BORDER_CONSTANT, value=(0, 0, 0))
+        return crop, (top, left)
+
+    @staticmethod
+    def to_image_points(points, offset, crop_shape, image_shape):
+        """
+        Map normalized points of a crop (or of the crop resized to any size) to the image it was cropped from
+        :param points: (n, 2) normalized (x, y) on the crop
+        :param offset: (top, left) of the crop in the image
+        :param crop_shape:
+        :param image_shape:
+        :return: (n, 2) normalized (x, y) on the image
+        """
+        crop_h, crop_w = crop_shape[:2]
+        image_h, image_w = image_shape[:2]
+        mapped = np.empty_like(points)
+        mapped[:, 0] = (offset[1] + points[:, 0] * crop_w) / image_w
+        mapped[:, 1] = (offset[0] + points[:, 1] * crop_h) / image_h
+        return mapped
+
+    def prepare(self, image):
+        """
+        Crop an image around the person
+        :param image:
+        :return: crop and the (offset, crop shape) needed to map its keypoints back, None crop if no person was found
+        """
+        box = self.detect(image)
+        if box is None:
+            return None, None
+        crop, offset = self.crop(image, self.window(box, image.shape))
+        return crop, (offset, crop.shape)
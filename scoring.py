@@ -0,0 +1,82 @@
+import numpy as np
+
+# top parts only (upper), compared between the merged and the original skeletons
+UPPER_PARTS = np.array([0, 1, 2, 3, 4, 5, 6, 7, 14, 15, 16, 17])
+# parts summed into the skeleton score
+SCORE_PARTS = np.arange(0, 17)
+# hips, knees and ankles, the parts drawn on the partial skeleton video
+LEG_PARTS = np.arange(8, 14)
+
+
+def masked_rmse(candidates, references, candidates_mask, references_mask, sizes, parts=UPPER_PARTS):
+    """
+    Root of the mean euclidean distance between the parts found in both skeletons, per candidate
+    :param candidates: (n, 18, 2+) normalized points
+    :param references: (n, 18, 2+) normalized points
+    :param candidates_mask: (n, 18)
+    :param references_mask: (n, 18)
+    :param sizes: (n, 2) or (2,) multipliers of the normalized x and y
+    :param parts: part indices to compare
+    :return: (n,) array, NaN where no part is found in both skeletons
+    """
+    sizes = np.asarray(sizes, np.float64).reshape((-1, 1, 2))
+    candidates = np.asarray(candidates)[:, parts, :2] * sizes
+    references = np.asarray(references)[:, parts, :2] * sizes
+    mask = np.asarray(candidates_mask)[:, parts] & np.asarray(references_mask)[:, parts]
+    distances = np.sqrt(((candidates - references) ** 2).sum(axis=2))
+    counts = mask.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt(np.where(mask, distances, 0).sum(axis=1) / counts)
+
+
+def score_sums(scores, mask, parts=SCORE_PARTS):
+    """
+    Sum of the detected parts scores, per candidate
+    :param scores: (n, 18) part scores
+    :param mask: (n, 18)
+    :param parts: part indices to sum
+    :return: (n,) array
+    """
+    scores = np.asarray(scores, np.float64)[:, parts]
+    return np.where(np.asarray(mask)[:, parts], scores, 0).sum(axis=1)
+
+
+def normalize(values):
+    """
+    Scale to a 0 mean and unit variance
+    :param values:
+    :return:
+    """
+    x = np.asarray(values)
+    res = (x - x.mean()) / x.std()
+    return res
+
+
+def confidence(rmses, scores, lam):
+    """
+    Confidence of each candidate from its normalized RMSE and skeleton score
+    :param rmses:
+    :param scores:
+    :param lam: weight of the skeleton score
+    :return: (n,) array
+    """
+    return (1 - lam) * normalize(rmses) + lam * normalize(scores)
+
+
+def score_candidates(candidates, references, candidates_mask, references_mask, sizes, lam,
+                     rmse_parts=UPPER_PARTS, score_parts=SCORE_PARTS):
+    """
+    Score a whole candidate set in one pass
+    :param candidates: (n, 18, 3) merged image skeletons (x, y, score)
+    :param references: (n, 18, 2+) original image skeletons
+    :param candidates_mask: (n, 18)
+    :param references_mask: (n, 18)
+    :param sizes: (n, 2) or (2,) multipliers of the normalized x and y
+    :param lam: weight of the skeleton score
+    :param rmse_parts: part indices compared for the RMSE
+    :param score_parts: part indices summed for the score
+    :return: rmses, scores, confidences
+    """
+    rmses = masked_rmse(candidates, references, candidates_mask, references_mask, sizes, rmse_parts)
+    scores = score_sums(np.asarray(candidates)[:, :, 2], candidates_mask, score_parts)
+    return rmses, scores, confidence(rmses, scores, lam)
@@ -8,9 +8,73 @@ import cv2
 import time
 
 
+def decode_boxes(boxes, im_height, im_width):
+    """
+    Convert normalized detection boxes to pixels
+    :param boxes: (n, 4) array of normalized (top, left, bottom, right)
+    :param im_height:
+    :param im_width:
+    :return: (n, 4) int array
+    """
+    return (boxes * np.array([im_height, im_width, im_height, im_width], boxes.dtype)).astype(np.int64)
+
+
+def non_max_suppression(boxes, scores, overlap_threshold):
+    """
+    Greedy non maximum suppression
+    :param boxes: (n, 4) array of (top, left, bottom, right)
+    :param scores: (n,) array
+    :param overlap_threshold: max intersection over union with a kept box
+    :return: indices of the kept boxes, highest score first
+    """
+    boxes = boxes.astype(np.float64)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while len(order) > 0:
+        i = order[0]
+        keep.append(i)
+        top = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        left = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        bottom = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        right = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        intersection = np.maximum(0, bottom - top) * np.maximum(0, right - left)
+        union = areas[i] + areas[order[1:]] - intersection
+        iou = np.where(union > 0, intersection / np.maximum(union, 1e-12), 0)
+        order = order[1:][iou <= overlap_threshold]
+    return np.array(keep, np.int64)
+
+
+def filter_detections(boxes, scores, classes, threshold=None, class_id=None, nms_threshold=None):
+    """
+    Keep the detections of a class above a score threshold
+    :param boxes: (n, 4) int array of pixel boxes
+    :param scores: (n,) array
+    :param classes: (n,) int array
+    :param threshold: min score, None keeps all the scores
+    :param class_id: class to keep (1 is human), None keeps all the classes
+    :param nms_threshold: IoU threshold of non maximum suppression, None skips it
+    :return: (k, 4) int array of the kept boxes
+    """
+    keep = np.ones(len(scores), np.bool_)
+    if threshold is not None:
+        keep &= scores > threshold
+    if class_id is not None:
+        keep &= classes == class_id
+    boxes = boxes[keep]
+    if nms_threshold is not None and len(boxes) > 0:
+        boxes = boxes[non_max_suppression(boxes, scores[keep], nms_threshold)]
+    return boxes
+
+
 class DetectorAPI:
-    def __init__(self, path_to_ckpt):
+    def __init__(self, path_to_ckpt, timing_hook=None):
+        """
+        :param path_to_ckpt: frozen inference graph path
+        :param timing_hook: optional function called with the seconds spent in each session run
+        """
         self.path_to_ckpt = path_to_ckpt
+        self.timing_hook = timing_hook
 
         self.detection_graph = tf.Graph()
         with self.detection_graph.as_default():
@@ -33,7 +97,16 @@ class DetectorAPI:
         self.detection_classes = self.detection_graph.get_tensor_by_name('detection_classes:0')
         self.num_detections = self.detection_graph.get_tensor_by_name('num_detections:0')
 
-    def processFrame(self, image):
+    def processFrame(self, image, as_array=False, threshold=None, class_id=None, nms_threshold=None):
+        """
+        Detect objects in a single image
+        :param image:
+        :param as_array: return only the filtered boxes as an (k, 4) int array
+        :param threshold: min score (array mode)
+        :param class_id: class to keep, 1 is human (array mode)
+        :param nms_threshold: IoU threshold of non maximum suppression, None skips it (array mode)
+        :return: boxes list, scores list, classes list, num - or the (k, 4) boxes array in array mode
+        """
         # Expand dimensions since the trained_model expects images to have shape: [1, None, None, 3]
         image_np_expanded = np.expand_dims(image, axis=0)
         # Actual detection.
@@ -41,17 +114,15 @@ class DetectorAPI:
         (boxes, scores, classes, num) = self.sess.run(
             [self.detection_boxes, self.detection_scores, self.detection_classes, self.num_detections],
             feed_dict={self.image_tensor: image_np_expanded})
-        end_time = time.time()
-
-        print("Elapsed Time:", end_time - start_time)
+        if self.timing_hook is not None:
+            self.timing_hook(time.time() - start_time)
 
         im_height, im_width, _ = image.shape
-        boxes_list = [None for i in range(boxes.shape[1])]
-        for i in range(boxes.shape[1]):
-            boxes_list[i] = (int(boxes[0, i, 0] * im_height),
-                             int(boxes[0, i, 1] * im_width),
-                             int(boxes[0, i, 2] * im_height),
-                             int(boxes[0, i, 3] * im_width))
+        pixel_boxes = decode_boxes(boxes[0], im_height, im_width)
+        if as_array:
+            return filter_detections(pixel_boxes, scores[0], classes[0].astype(np.int64), threshold, class_id,
+                                     nms_threshold)
+        boxes_list = [tuple(box) for box in pixel_boxes.tolist()]
 
         return boxes_list, scores[0].tolist(), [int(x) for x in classes[0].tolist()], int(num[0])
 
@@ -62,7 +133,7 @@ class DetectorAPI:
 
 if __name__ == "__main__":
     model_path = 'faster_rcnn_inception_v2_coco_2018_01_28/frozen_inference_graph.pb'
-    odapi = DetectorAPI(path_to_ckpt=model_path)
+    odapi = DetectorAPI(path_to_ckpt=model_path, timing_hook=lambda seconds: print("Elapsed Time:", seconds))
     threshold = 0.7
     cap = cv2.VideoCapture('videos/walking.mp4')
 
@@ -70,15 +141,12 @@ if __name__ == "__main__":
         r, img = cap.read()
         img = cv2.resize(img, (1280, 720))
 
-        boxes, scores, classes, num = odapi.processFrame(img)
+        # Class 1 represents human
+        boxes = odapi.processFrame(img, as_array=True, threshold=threshold, class_id=1)
 
         # Visualization of the results of a detection.
-
-        for i in range(len(boxes)):
-            # Class 1 represents human
-            if classes[i] == 1 and scores[i] > threshold:
-                box = boxes[i]
-                cv2.rectangle(img, (box[1], box[0]), (box[3], box[2]), (255, 0, 0), 2)
+        for box in boxes.tolist():
+            cv2.rectangle(img, (box[1], box[0]), (box[3], box[2]), (255, 0, 0), 2)
 
         cv2.imshow("preview", img)
         key = cv2.waitKey(1)
@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from Skeleton import Skeleton
+
+
+def fit_upper(upper_image, height_b, width_b):
+    """
+    Warp the upper image to the size of a scaled bottom image and crop it to its content
+    :param upper_image:
+    :param height_b: scaled bottom height
+    :param width_b: scaled bottom width
+    :return: cropped upper affined image
+    """
+    height_u, width_u, channels = upper_image.shape
+    pts1 = np.float32([[0, width_u],
+                       [height_u, 0],
+                       [height_u, width_u]])
+    pts2 = np.float32([[0, width_b],
+                       [height_b, 0],
+                       [height_b, width_b]])
+    upper_affined_image = cv2.warpAffine(upper_image, cv2.getAffineTransform(pts1, pts2), (width_u, height_u))
+
+    # remove black pixel from affined image
+    # 1 Convert image into grayscale, and make in binary image for threshold value of 1.
+    gray = cv2.cvtColor(upper_affined_image, cv2.COLOR_BGR2GRAY)
+    ret, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
+    # 2  Find contours in image. There will be only one object, so find bounding rectangle for it
+    image, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cnt = contours[0]
+    # 3 Crop image and save it to another one
+    x, y, w, h = cv2.boundingRect(cnt)
+    return upper_affined_image[y:y + h, x:x + w].copy()
+
+
+class UpperEntry(object):
+    """
+    A fitted upper image with its skeleton
+    """
+    __slots__ = ('image', 'skeleton')
+
+    # shoulders and hips, the parts the upper is aligned to the bottom with
+    KEYPOINTS = [2, 5, 8, 11]
+
+    def __init__(self, image, skeleton=None):
+        """
+        Constructor
+        :param image: cropped upper affined image
+        :param skeleton: Skeleton of the image, None if it was not inferred
+        """
+        self.image = image
+        self.skeleton = skeleton
+
+    @property
+    def keypoints(self):
+        """
+        :return: (4, 2) pixel coordinates of the shoulders and hips, NaN where missing, None without a skeleton
+        """
+        if self.skeleton is None:
+            return None
+        height, width = self.image.shape[:2]
+        points = self.skeleton.points[self.KEYPOINTS, :2] * np.float32([width, height])
+        points[~self.skeleton.mask[self.KEYPOINTS]] = np.nan
+        return points
+
+
+class UpperLibrary(object):
+    """
+    This class purpose is to fit every upper image to every scaled bottom size only once per dataset.
+    The fitted uppers (and their skeletons when an estimator is given) are kept in memory and saved to a folder,
+    keyed by the upper file and the target size, so later searches and new bottom images only do lookups.
+    """
+
+    def __init__(self, folder, estimator=None):
+        """
+        Constructor
+        :param folder: folder the entries are saved to
+        :param estimator: TfPoseEstimator used to infer the uppers' skeletons, None skips them
+        """
+        self.folder = folder
+        self.estimator = estimator
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._upper_ids = {}
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def _upper_id(self, upper_path):
+        # the file path, modification time and size identify the upper without reading it
+        if upper_path not in self._upper_ids:
+            stat = os.stat(upper_path)
+            value = '{}|{}|{}'.format(os.path.abspath(upper_path), stat.st_mtime, stat.st_size)
+            self._upper_ids[upper_path] = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        return self._upper_ids[upper_path]
+
+    def entry_path(self, upper_path, size):
+        """
+        :param upper_path:
+        :param size: (height, width) of the scaled bottom image
+        :return: file of the entry
+        """
+        return os.path.join(self.folder, '{}-{}x{}.npz'.format(self._upper_id(upper_path), size[0], size[1]))
+
+    def _load(self, path):
+        with np.load(path) as data:
+            skeleton = Skeleton(data['points'], data['mask']) if bool(data['has_skeleton']) else None
+            return UpperEntry(data['image'], skeleton)
+
+    def _save(self, path, entry):
+        skeleton = entry.skeleton if entry.skeleton is not None else Skeleton()
+        # write to a temporary file first so a half written entry is never loaded (several processes may share it)
+        part_path = '{}.{}.part.npz'.format(path[:-len('.npz')], os.getpid())
+        np.savez(part_path, image=entry.image, points=skeleton.points, mask=skeleton.mask,
+                 has_skeleton=entry.skeleton is not None)
+        os.replace(part_path, path)
+
+    def get(self, upper_image, upper_path, size):
+        """
+        Get the upper fitted to a scaled bottom size, fit it only if no process did it before
+        :param upper_image: upper image, may be None when the entry is already in the library
+        :param upper_path: upper image file
+        :param size: (height, width) of the scaled bottom image
+        :return: UpperEntry
+        """
+        path = self.entry_path(upper_path, size)
+        entry = self._entries.get(path)
+        if entry is None and os.path.exists(path):
+            entry = self._load(path)
+        if entry is not None and (entry.skeleton is not None or self.estimator is None):
+            self.hits += 1
+            self._entries[path] = entry
+            return entry
+
+        self.misses += 1
+        if entry is None:
+            if upper_image is None:
+                upper_image = cv2.imread(upper_path)
+            entry = UpperEntry(fit_upper(upper_image, size[0], size[1]))
+        if self.estimator is not None:
+            entry.skeleton = Skeleton.best(self.estimator.inference(entry.image, scales=None)) or Skeleton()
+        self._save(path, entry)
+        self._entries[path] = entry
+        return entry
+
+    def build(self, upper_images, sizes):
+        """
+        Fit all the uppers to all the sizes
+        :param upper_images: list of [image, path]
+        :param sizes: (height, width) sizes of the scaled bottom images
+        :return: number of entries
+        """
+        sizes = sorted(set(tuple(size) for size in sizes))
+        for upper_image, upper_path in upper_images:
+            for size in sizes:
+                self.get(upper_image, upper_path, size)
+        return len(upper_images) * len(sizes)
+
+    def __str__(self):
+        return 'UpperLibrary({}): {} entries in memory, hits={} misses={}'.format(self.folder, len(self._entries),
+                                                                                  self.hits, self.misses)
+
+
+def scaled_size(bottom_image, factor):
+    """
+    :param bottom_image:
+    :param factor: bottom scale factor
+    :return: (height, width) of the scaled bottom image
+    """
+    height_b, width_b = bottom_image.shape[:2]
+    return int(height_b * factor), int(width_b * factor)
+
+
+if __name__ == '__main__':
+    # this main builds the library of the upper and bottom image folders used by the grid search
+    import video_utils
+    from PartialSkeleton import SCALE_FACTORS
+    from model_registry import get_pose_estimator
+
+    parser = argparse.ArgumentParser(description='build the upper body library')
+    parser.add_argument('--folder', type=str, default='./upper_library', help='library folder')
+    parser.add_argument('--skeletons', action='store_true', help='infer and store the uppers skeletons too')
+    args = parser.parse_args()
+    uppper_images = video_utils.load_images_from_folder("./images/upper/", True)
+    bottom_images = video_utils.load_images_from_folder("./images/bottom/", True)
+    library = UpperLibrary(args.folder, get_pose_estimator('mobilenet_thin', (432, 368)) if args.skeletons else None)
+    sizes = [scaled_size(bottom_image, factor) for bottom_image, _ in bottom_images for factor in SCALE_FACTORS]
+    print("{} entries".format(library.build(uppper_images, sizes)))
+    print(library)
@@ -1,30 +1,158 @@
-import cv2
+import json
 import os
+import re
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def natural_sort_key(filename):
+    """
+    Sort key ordering the numbers inside file names by value (frame2.png before frame10.png)
+    :param filename:
+    :return:
+    """
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part.lower())
+            for part in re.split(r'(\d+)', filename) if part]
+
+
+def list_image_files(folder, sort=False):
+    """
+    :param folder:
+    :param sort: sort the files by name, numbers compared by value
+    :return: file paths
+    """
+    file_list = os.listdir(folder)
+    if sort:
+        file_list = sorted(file_list, key=natural_sort_key)
+    return [os.path.join(folder, filename) for filename in file_list]
+
+
+def iter_images(folder, save_path=False, sort=False, workers=8, prefetch=16):
+    """
+    Decode the images of a folder lazily (generator), up to prefetch images are decoded ahead on a thread pool
+    so the full set is never held in memory
+    :param folder:
+    :param save_path: yield [image, path] instead of the image
+    :param sort: sort images by filename, numbers compared by value
+    :param workers: decoding threads
+    :param prefetch: max images decoded ahead
+    :return: images, files that are not images are skipped
+    """
+    paths = list_image_files(folder, sort)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(cv2.imread, path)))
+            if len(pending) < prefetch:
+                continue
+            path, future = pending.popleft()
+            image = future.result()
+            if image is not None:
+                yield [image, path] if save_path else image
+        while pending:
+            path, future = pending.popleft()
+            image = future.result()
+            if image is not None:
+                yield [image, path] if save_path else image
 
 
-def load_images_from_folder(folder,save_path=False,sort = False):
+def load_images_from_folder(folder,save_path=False,sort = False, workers=8):
     """
     Load images from folder
     :param folder:
     :param save_path: save path\filename
-    :param sort: sort images by filename (ascending)
+    :param sort: sort images by filename (ascending), numbers compared by value
+    :param workers: decoding threads
     :return:
     """
+    paths = list_image_files(folder, sort)
+    # cv2 releases the GIL while decoding, so the images are read in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        decoded = list(executor.map(cv2.imread, paths))
     images = []
-    file_list = os.listdir(folder)
-    if sort:
-        file_list = sorted(file_list,key=lambda x: int(os.path.splitext(x)[0]))
-
-    for filename in file_list:
-        image = cv2.imread(os.path.join(folder, filename))
+    for path, image in zip(paths, decoded):
         if image is not None:
             if save_path:
-                images.append([image, os.path.join(folder, filename)])
+                images.append([image, path])
             else:
                 images.append(image)
     return images
 
 
+def _folder_signature(paths):
+    # names, sizes and modification times identify the content of the folder without reading it
+    return [[os.path.basename(path), os.path.getsize(path), os.path.getmtime(path)] for path in paths]
+
+
+def load_image_array(folder, size=None, sort=True, workers=8, cache_path=None):
+    """
+    Load the images of a folder into a single contiguous (n, height, width, 3) uint8 array
+    :param folder:
+    :param size: (width, height) the images are resized to, None uses the first image's size
+    :param sort: sort images by filename, numbers compared by value
+    :param workers: decoding threads
+    :param cache_path: file the array is kept in as a np.memmap, later calls map it without decoding while the
+                       folder is unchanged. None keeps the array in memory
+    :return: images array, image paths
+    """
+    paths = [path for path in list_image_files(folder, sort)
+             if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS]
+    signature = _folder_signature(paths)
+    header_path = cache_path + '.json' if cache_path is not None else None
+    if header_path is not None and os.path.exists(header_path) and os.path.exists(cache_path):
+        with open(header_path) as handle:
+            header = json.load(handle)
+        # without a size the cache must hold the images at the first image's native size
+        wanted = header.get('native_size') if size is None else list(size)
+        if header['signature'] == signature and wanted is not None and header['size'] == list(wanted):
+            images = np.memmap(cache_path, np.uint8, 'r', shape=tuple(header['shape']))
+            return images, header['paths']
+
+    if not paths:
+        return np.empty((0, 0, 0, 3), np.uint8), []
+    first = cv2.imread(paths[0])
+    if first is None:
+        raise IOError("Could not decode {}".format(paths[0]))
+    native_size = (first.shape[1], first.shape[0])
+    if size is None:
+        size = native_size
+    shape = (len(paths), size[1], size[0], 3)
+    if cache_path is not None:
+        if header_path is not None and os.path.exists(header_path):
+            # the header is written last, a cache without it is never mapped
+            os.remove(header_path)
+        images = np.memmap(cache_path, np.uint8, 'w+', shape=shape)
+    else:
+        images = np.empty(shape, np.uint8)
+
+    def decode(index):
+        image = cv2.imread(paths[index])
+        if image is None:
+            return False
+        if image.shape[:2] != shape[1:3]:
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        images[index] = image
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        decoded = list(executor.map(decode, range(len(paths))))
+    if not all(decoded):
+        raise IOError("Could not decode {}".format([path for path, ok in zip(paths, decoded) if not ok]))
+
+    if cache_path is not None:
+        images.flush()
+        with open(header_path, 'w') as handle:
+            json.dump({'shape': list(shape), 'size': list(size), 'native_size': list(native_size),
+                       'paths': paths, 'signature': signature}, handle)
+    return images, paths
+
+
 def split_video(vid_path, out_path):
     """
     Split video into frames
@@ -47,6 +175,70 @@ def split_video(vid_path, out_path):
             count += 1
 
 
+def read_frames(vid_path, size=(432, 368), start=0, stop=None):
+    """
+    Decode video frames one at a time (generator), nothing is written to disk
+    :param vid_path:
+    :param size: (width, height) of the yielded frames, None keeps the original size
+    :param start: index of the first frame to yield, earlier frames are skipped without decoding them fully
+    :param stop: index of the frame to stop at (not yielded), None reads to the end
+    :return: resized frames
+    """
+    vidcap = cv2.VideoCapture(vid_path)
+    try:
+        index = 0
+        while index < start:
+            if not vidcap.grab():
+                return
+            index += 1
+        while stop is None or index < stop:
+            success, image = vidcap.read()
+            if not success:
+                break
+            if size is not None:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            yield image
+            index += 1
+    finally:
+        vidcap.release()
+
+
+def get_fps(vid_path):
+    """
+    Get the frame rate of a video
+    :param vid_path:
+    :return: fps
+    """
+    vidcap = cv2.VideoCapture(vid_path)
+    fps = vidcap.get(cv2.CAP_PROP_FPS)
+    vidcap.release()
+    return fps
+
+
+def write_frames(frames, out_file, fps, fourcc='mp4v'):
+    """
+    Encode frames into a video file as they arrive, only one frame is held in memory at a time
+    :param frames: iterable of images with the same size
+    :param out_file: output video file path
+    :param fps:
+    :param fourcc: codec code
+    :return: number of written frames
+    """
+    writer = None
+    count = 0
+    try:
+        for frame in frames:
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(out_file, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+            writer.write(frame)
+            count += 1
+    finally:
+        if writer is not None:
+            writer.release()
+    return count
+
+
 def create_video(orig_video, images_path, out_path):
     """
     Generate mp4 video from given image and save them to output
@@ -62,6 +254,23 @@ def create_video(orig_video, images_path, out_path):
         "ffmpeg -f image2 -r {} -i {}/%01d.png -vcodec libx264 -y {}/output.mp4".format(fps, images_path, out_path))
 
 
+def concat_videos(video_files, out_file):
+    """
+    Concatenate videos with the same encoding into one file without re-encoding them (requires ffmpeg)
+    :param video_files:
+    :param out_file:
+    :return:
+    """
+    list_file = out_file + '.txt'
+    with open(list_file, 'w') as handle:
+        for video_file in video_files:
+            handle.write("file '{}'\n".format(os.path.abspath(video_file)))
+    try:
+        subprocess.check_call(['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', '-y', out_file])
+    finally:
+        os.remove(list_file)
+
+
 if __name__ == '__main__':
     # split_video("./videos/walking.mp4", "./videos/walking/")
     create_video("./videos/walking.mp4", "./videos/walking/", "./videos")